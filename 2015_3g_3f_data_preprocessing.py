@@ -1,97 +1,34 @@
 # Script that calls the data_processing.py program and analyze the
 # BARREL flight data from the 2015 flights 3G and 3F. The fast 
 # spectra and ephemeris data is merged from the 3G and 3F balloons
-# for every date in flight_dates and saved to ./merged_data/ folder
-# (created if does not exist).
+# for every date in flight_dates (the 3g_3f pair in flights.yaml) and
+# saved to ./merged_data/ folder (created if does not exist). The 
+# merging is done by run_pairs.py, so both scripts make (and record the
+# provenance of) the same merged files, and the merged files that are
+# up to date with their cdf files and merge parameters (see 
+# provenance.py) are not remade.
+#
+# Usage: python3 2015_3g_3f_data_preprocessing.py [--rescan]
 
-import pathlib
-# import os 
-# import spacepy.pycdf
+import argparse
 
 import directories
-import data_preprocessing
+import file_catalog
+import run_pairs
 
-flight_dates = ['20150825', '20150826']
-campaign_dir = pathlib.Path(directories.data_dir, 'campaign_3')
+parser = argparse.ArgumentParser(description='Merge the 2015 3G and 3F data.')
+parser.add_argument('--rescan', action='store_true', 
+    help='Rescan the whole cdf archive instead of only the changed directories.')
+args = parser.parse_args()
+
+config = run_pairs.load_config()
 
 # Make merged_data directory if it does not exist yet.
-if not pathlib.Path('merged_data').is_dir():
-    pathlib.Path('merged_data').mkdir(parents=True, exist_ok=True)
+if not directories.merged_dir.is_dir():
+    directories.merged_dir.mkdir(parents=True, exist_ok=True)
     print(f'Made a merged_data/ directory')
 
-### EPHEMERIS PROCESSING ###
-ephem_match_name = 'bar_*_l2_ephm_*.cdf'
-flight_dates = ['20150825', '20150826'] # Flight days to plot
-ephem_save_name = 'barrel_3g_3f_merged_ephemeris.csv'
-
-ephem_paths = sorted(campaign_dir.rglob(ephem_match_name), 
-                key=lambda i: i.name.split('_')[4])
-print('2015 BARREL campaign fast ephemeris files sorted by date'
-    ' (not all will be processed):')
-for path in ephem_paths:
-    print(path.name)
-
-ephem = {date:{} for date in flight_dates}
-
-for path in ephem_paths:
-    flight_date = path.name.split('_')[4]
-    payload = path.name.split('_')[1]
-
-    if flight_date in flight_dates:
-        # Load the ephemeris data into ephem dictionary with date keys.
-        # For each key date, save the dataframe into a payload dictionary.
-        ephem[flight_date][payload] = data_preprocessing.load_barrel_ephem(str(path))
-
-ephem_merged = {}
-
-for date in ephem:
-    ephem_merged[date] = data_preprocessing.merge_ballon_data(ephem[date])
-
-ephem_merged = data_preprocessing.merge_ballon_times(ephem_merged)
-
-# Calculate the balloon separation.
-ephem_merged['dist_km'] = data_preprocessing.haversine(
-                    ephem_merged[['3G_GPS_Lat', '3G_GPS_Lon', '3G_GPS_Alt']], 
-                    ephem_merged[['3F_GPS_Lat', '3F_GPS_Lon', '3F_GPS_Alt']]
-                                                        )
-ephem_merged.to_csv(pathlib.Path('merged_data', ephem_save_name), 
-                    index_label='Time')
-
-# ### FAST SPECTRA PROCESSING ###
-fs_match_name = 'bar_*_l2_fspc_*.cdf'
-fs_save_name = 'barrel_3g_3f_merged_fast_spectra.csv'
-
-fs_paths = sorted(campaign_dir.rglob(fs_match_name), 
-                key=lambda i: i.name.split('_')[4])
-
-print('2015 BARREL campaign fast spectra files sorted by date '
-    '(not all will be processed):')
-for path in fs_paths:
-    print(path.name)
-
-# Make a dictionary of dictionaries. The parent level dictionary
-# has the dates and the child dictionary has the payloads that 
-# flew on those days.
-fs = {date:{} for date in flight_dates}
-
-for path in fs_paths:
-    flight_date = path.name.split('_')[4]
-    payload = path.name.split('_')[1]
-
-    if flight_date in flight_dates:
-        # Load the fast spectra data into ephem dictionary with date keys.
-        # For each key date, save the dataframe into a payload dictionary.
-        fs[flight_date][payload] = data_preprocessing.load_barrel_spectra(str(path))
-
-fs_merged = {}
-
-for date in fs:
-    fs_merged[date] = data_preprocessing.merge_ballon_data(
-                            fs[date], 
-                            tolerance_min=1/60
-                            )
-
-fs_merged = data_preprocessing.merge_ballon_times(fs_merged)
-
-fs_merged.to_csv(pathlib.Path('merged_data', fs_save_name), 
-                    index_label='Time')
\ No newline at end of file
+# Update the saved archive index. The directories with new files are 
+# rescanned.
+file_catalog.load_index(directories.data_dir, rescan=args.rescan)
+run_pairs.process_pair('3g_3f', config['pairs']['3g_3f'], config['detection'], ['preprocess'])
@@ -9,37 +9,69 @@ import pandas as pd
 from pandas.plotting import register_matplotlib_converters
 register_matplotlib_converters()
 
+import directories
+import provenance
+
 save_fig = False
-fs_path = pathlib.Path('merged_data', 'barrel_3g_3f_merged_fast_spectra.csv')
-ephem_dir = pathlib.Path('merged_data', 'barrel_3g_3f_merged_ephemeris.csv')
+# Show the zoomed out summary plot. It reads the merged data even if 
+# all of the tiles below are up to date.
+show_summary = False
+fs_path = pathlib.Path(directories.merged_dir, 'barrel_3g_3f_merged_fast_spectra.csv')
+ephem_dir = pathlib.Path(directories.merged_dir, 'barrel_3g_3f_merged_ephemeris.csv')
+
+### FIND THE NARROWER SUMMARY PLOTS TO MAKE ###
+# These tile the whole interval. To only plot the detected events use
+# snapshots.py with the batch_detect.py event catalog. The tiles that
+# are up to date with the merged files (see provenance.py) are not 
+# replotted, and the merged files are only read if a tile is stale.
+
+xlabel_variables = ['3G_L_Kp2', '3G_MLT_Kp2_T89c', '3G_GPS_Alt', '3F_GPS_Alt', 'dist_km']
+tile_params = {'xlabel_variables':xlabel_variables}
+time_freq = '2min'
+
+times = pd.date_range('20150826T04:30:00', '20150826T08:25:00', freq=time_freq)
+stale_tiles = []
+for start_time, end_time in zip(times[:-1], times[1:]):
+    save_name = (f'{datetime.strftime(start_time, "%Y%m%d_%H%M")}_'
+                f'{datetime.strftime(end_time, "%H%M")}_BARREL_'
+                '3G_3F_fast_spectra.png')
+    save_path = pathlib.Path(directories.plots_dir, time_freq, save_name)
+    if not provenance.is_fresh(save_path, [fs_path, ephem_dir], tile_params):
+        stale_tiles.append((start_time, end_time, save_path))
+print(f'{len(stale_tiles)} of {len(times)-1} tiles need to be plotted.')
 
-fs = pd.read_csv(fs_path, index_col=0, parse_dates=True)
-# fs.index = pd.to_datetime(fs.index)
-print(fs.head())
+if len(stale_tiles) or show_summary:
+    fs = pd.read_csv(fs_path, index_col=0, parse_dates=True)
+    # fs.index = pd.to_datetime(fs.index)
+    print(fs.head())
 
-ephem = pd.read_csv(ephem_dir, index_col=0, parse_dates=True)
-# ephem.index = pd.to_datetime(ephem.index)
-print(ephem.head())
+    ephem = pd.read_csv(ephem_dir, index_col=0, parse_dates=True)
+    # ephem.index = pd.to_datetime(ephem.index)
+    print(ephem.head())
 
-# Filter the fast spectra
-filtered_fs = fs['20150825T09:00:00':'20150826T9:00:00']
+if show_summary:
+    # Filter the fast spectra
+    filtered_fs = fs['20150825T09:00:00':'20150826T9:00:00']
 
-if filtered_fs.shape[0] > 100_000:
-    # Downsample to make plotting faster
-    filtered_fs = filtered_fs.loc[::filtered_fs.shape[0]//100_000]
+    if filtered_fs.shape[0] > 100_000:
+        # Downsample to make plotting faster
+        filtered_fs = filtered_fs.loc[::filtered_fs.shape[0]//100_000]
 
-### PLOT THE ZOOMED OUT SUMMARY PLOT ###
-fig, bx = plt.subplots(2, 1, sharex=True, figsize=(10, 5))
+    ### PLOT THE ZOOMED OUT SUMMARY PLOT ###
+    fig, bx = plt.subplots(2, 1, sharex=True, figsize=(10, 5))
 
-for column in filtered_fs.columns:
-    if '3G' in column: 
-        plt_num=0
-    else:
-        plt_num=1
-    bx[plt_num].plot(filtered_fs.index, filtered_fs[column], label=column)
+    for column in filtered_fs.columns:
+        if 'FSPC' not in column:
+            # Skip the gap and time stamp quality columns.
+            continue
+        if '3G' in column: 
+            plt_num=0
+        else:
+            plt_num=1
+        bx[plt_num].plot(filtered_fs.index, filtered_fs[column], label=column)
 
-bx[0].legend(loc=1)
-bx[1].legend(loc=1)
+    bx[0].legend(loc=1)
+    bx[1].legend(loc=1)
 
 # def onMouseMove(event):
 #     """
@@ -57,8 +89,6 @@ bx[1].legend(loc=1)
 
 ### MAKE NARROWER SUMMARY PLOTS ###
 
-xlabel_variables = ['3G_L_Kp2', '3G_MLT_Kp2_T89c', '3G_GPS_Alt', '3F_GPS_Alt', 'dist_km']
-
 def xlabel_func(i):
     date = str(ephem.index[i].date())
     time = str(ephem.index[i].strftime("%H:%M:%S"))
@@ -76,17 +106,14 @@ def format_fn(tick_val, tick_pos):
     idx = np.argmin(np.abs(numeric_time-tick_val))
     return xlabel_func(idx)
 
-
-time_freq = '2min'
-
-if not pathlib.Path('plots', time_freq).is_dir():
-    pathlib.Path('plots', time_freq).mkdir(parents=True, exist_ok=True)
+if not pathlib.Path(directories.plots_dir, time_freq).is_dir():
+    pathlib.Path(directories.plots_dir, time_freq).mkdir(parents=True, exist_ok=True)
     print(f'Made a plots/{time_freq}/ directory')
 
-times = pd.date_range('20150826T04:30:00', '20150826T08:25:00', freq=time_freq)
-fig, cx = plt.subplots(2, 1, sharex=True, figsize=(10, 5), sharey=True)
+if len(stale_tiles):
+    fig, cx = plt.subplots(2, 1, sharex=True, figsize=(10, 5), sharey=True)
 
-for start_time, end_time in zip(times[:-1], times[1:]):
+for start_time, end_time, save_path in stale_tiles:
     filtered_fs = fs[start_time:end_time]
 
     if filtered_fs.shape[0] > 100_000:
@@ -94,6 +121,9 @@ for start_time, end_time in zip(times[:-1], times[1:]):
         filtered_fs = filtered_fs.loc[::filtered_fs.shape[0]//100_000]
 
     for column in filtered_fs.columns:
+        if 'FSPC' not in column:
+            # Skip the gap and time stamp quality columns.
+            continue
         if '3G' in column: 
             plt_num=0
         else:
@@ -110,10 +140,8 @@ for start_time, end_time in zip(times[:-1], times[1:]):
     cx[-1].xaxis.set_label_coords(-0.07,-0.06)
     plt.subplots_adjust(bottom=0.25)
 
-    save_name = (f'{datetime.strftime(start_time, "%Y%m%d_%H%M")}_'
-                f'{datetime.strftime(end_time, "%H%M")}_BARREL_'
-                '3G_3F_fast_spectra.png')
-    plt.savefig(pathlib.Path('plots', time_freq, save_name), dpi=200)
+    plt.savefig(save_path, dpi=200)
+    provenance.write_metadata(save_path, None, [fs_path, ephem_dir], tile_params)
     cx[0].clear()
     cx[1].clear()
 
@@ -8,8 +8,10 @@ import pandas as pd
 from pandas.plotting import register_matplotlib_converters
 register_matplotlib_converters()
 
+import directories
+
 save_fig = False
-data_dir = pathlib.Path('merged_data', 'barrel_3g_3f_merged_ephemeris.csv')
+data_dir = pathlib.Path(directories.merged_dir, 'barrel_3g_3f_merged_ephemeris.csv')
 
 ephem = pd.read_csv(data_dir, index_col=0, parse_dates=True)
 # ephem.index = pd.to_datetime(ephem.index)
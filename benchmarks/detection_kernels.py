@@ -0,0 +1,81 @@
+# Compares the run time of the Detect rolling statistics with the
+# pandas, NumPy, and (if it is installed) Numba engines on a synthetic
+# flight of fast spectra, and checks that the engines agree. The first
+# Numba call compiles the kernels, so it is run once before timing.
+#
+# Usage (from the top directory): python3 benchmarks/detection_kernels.py --hours 4 8 24
+
+import argparse
+import pathlib
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+top_dir = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(top_dir / 'microburst_detection'))
+import find_microbursts
+import rolling
+
+config = {
+    'baseline_width_min':5,
+    'baseline_std_thresh':2,
+    'correlation_width_s':1,
+    'correlation_thresh':0.8,
+    'detect_channel':'FSPC1a',
+    }
+
+def synthetic_fs(hours:float, cadence_s:float=50E-3, seed:int=0) -> pd.DataFrame:
+    """
+    Poisson counts of two payloads on the cadence grid, with a few
+    data gaps.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(3600*hours/cadence_s)
+    fs = pd.DataFrame(
+        {f'{payload}_FSPC1a':rng.poisson(30, n).astype(float) for payload in ['3G', '3F']},
+        index=pd.date_range('2015-08-26', periods=n, freq=f'{int(1E3*cadence_s)}ms')
+        )
+    for start in rng.integers(0, n-100, size=10):
+        fs.iloc[start:start+100, 0] = np.nan
+    fs['gap'] = fs.isna().any(axis=1)
+    return fs
+
+def run_engine(fs:pd.DataFrame, engine:str, runs:int) -> tuple:
+    """
+    Return the best detect() run time and the Detect object.
+    """
+    times = []
+    for _ in range(runs):
+        d = find_microbursts.Detect(None, None, {**config, 'engine':engine})
+        d.set_merged_data(fs, pd.DataFrame())
+        start = time.perf_counter()
+        d.detect()
+        times.append(time.perf_counter() - start)
+    return min(times), d
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Detect rolling statistics benchmark.')
+    parser.add_argument('--hours', type=float, nargs='+', default=[1, 4, 12])
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    engines = ['pandas'] + rolling.engines
+    if 'numba' in engines:
+        # Compile the kernels.
+        run_engine(synthetic_fs(0.1), 'numba', 1)
+    else:
+        print('Numba is not installed, only the pandas and NumPy engines are compared.')
+
+    print(f'{"hours":>6} {"engine":<8} {"time [s]":>9} {"speedup":>8} {"max |corr diff|":>16} '
+          f'{"max |n_std diff|":>17}')
+    for hours in args.hours:
+        fs = synthetic_fs(hours)
+        reference_time, reference = run_engine(fs, 'pandas', args.runs)
+        for engine in engines:
+            run_time, d = run_engine(fs, engine, args.runs)
+            corr_diff = np.nanmax(np.abs(d.corr.to_numpy() - reference.corr.to_numpy()))
+            n_std_diff = np.nanmax(np.abs(d.n_std.to_numpy() - reference.n_std.to_numpy()))
+            print(f'{hours:>6.1f} {engine:<8} {run_time:>9.3f} {reference_time/run_time:>8.1f} '
+                  f'{corr_diff:>16.2e} {n_std_diff:>17.2e}')
@@ -0,0 +1,367 @@
+# Checks the optimized and replaced paths against the code they replaced,
+# so a faster engine can't silently change the microburst lists:
+#
+# - The timestamp repair pipeline (repair_timestamps, merge_ballon_grid,
+#   and resample_fixed_cadence) against a frozen copy of the original 
+#   sort_index pipeline. They must agree exactly at the time stamps that
+#   were not displaced or duplicated.
+# - The Detect pandas engine against a frozen copy of the original 
+#   Detect statistics, so the published event lists can't change. Both
+#   run on the current merged fast spectra, where the original rolling
+#   windows are NaN over the gaps that Detect masks.
+# - The Detect numpy and numba engines and the chunk-parallel Detect
+#   against the Detect pandas engine.
+#
+# The fixtures are synthetic raw spectra of two payloads (Poisson counts
+# with injected coincident microbursts, data gaps, and out of place,
+# displaced, and duplicated time stamps) and, with --recorded, the 
+# merged csv files of the given pairs (only the Detect cases, since 
+# there are no raw spectra). The agreement is checked against per-output
+# tolerances, and the speedup and tracemalloc peak memory ratios of the
+# new paths are reported next to it. The chunked Detect workers are 
+# separate processes, so their memory is not in its peak.
+#
+# The intended difference from the original code, the repaired values
+# at the disturbed time stamps, is reported but not checked.
+#
+# With --golden DIR the Detect pandas engine outputs are also saved to
+# (or, if they already exist, compared with) DIR/<fixture>.npz, to catch
+# changes to the reference inputs or libraries between runs.
+#
+# Usage (from the top directory):
+#     python3 benchmarks/regression_harness.py [--hours 2] [--recorded 3g_3f] [--golden golden/]
+# The exit code is 1 if any checked case is out of tolerance.
+
+import argparse
+import pathlib
+import sys
+import time
+import tracemalloc
+import typing
+
+import numpy as np
+import pandas as pd
+
+top_dir = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(top_dir))
+sys.path.append(str(top_dir / 'microburst_detection'))
+import data_preprocessing
+import directories
+import find_microbursts
+import rolling
+
+config = {
+    'baseline_width_min':5,
+    'baseline_std_thresh':2,
+    'correlation_width_s':1,
+    'correlation_thresh':0.8,
+    'detect_channel':'FSPC1a',
+    }
+
+# The maximum absolute differences allowed from the reference outputs.
+tolerances = {
+    'merged':0,
+    'corr':1E-9,
+    'n_std':1E-9,
+    'event_times':0,
+    }
+
+### FROZEN REFERENCE IMPLEMENTATIONS ###
+# Verbatim copies of the original code. Don't optimize or fix these.
+
+def reference_load_barrel_spectra(spec):
+    # The end of the original load_barrel_spectra, after the cdf file
+    # was read into spec.
+    spec.sort_index(inplace=True)
+    return spec
+
+def reference_merge_ballon_data(ephem, tolerance_min=5):
+    for payload in ephem:
+        ephem[payload] = ephem[payload].add_prefix(f'{payload}_')
+    payload_id = [key for key, _ in ephem.items()]
+    return pd.merge_asof(ephem[payload_id[0]], ephem[payload_id[1]],
+                        left_index=True, right_index=True,
+                        direction='nearest',
+                        tolerance=pd.Timedelta(minutes=tolerance_min))
+
+def reference_detect_statistics(fs:pd.DataFrame, config:typing.Dict,
+                                fs_cadence_s:float=50E-3) -> typing.Tuple[pd.Series, pd.DataFrame]:
+    """
+    The original Detect rolling_correlation and baseline_significance.
+    """
+    detect_channels = [column for column in fs.columns 
+                            if config['detect_channel'] in column ]
+    window_data_points = int(config['correlation_width_s']//fs_cadence_s)
+    corr = fs[detect_channels[0]].rolling(window=window_data_points).corr(fs[detect_channels[1]])
+
+    baseline_window_points = int(config['baseline_width_min']/fs_cadence_s)
+    rolling_average_a = fs[detect_channels[0]].rolling(window=baseline_window_points).mean()
+    rolling_average_b = fs[detect_channels[1]].rolling(window=baseline_window_points).mean()
+    n_std_a = (fs[detect_channels[0]]-rolling_average_a)/np.sqrt(rolling_average_a+1)
+    n_std_b = (fs[detect_channels[1]]-rolling_average_b)/np.sqrt(rolling_average_b+1)
+    n_std = pd.DataFrame(np.array([n_std_a, n_std_b]).T, columns=detect_channels)
+    return corr, n_std
+
+def reference_preprocess_spectra(raw:typing.Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    The original fast spectra merge of one day, without the frame 
+    counters that the original loader did not read.
+    """
+    spec = {payload:reference_load_barrel_spectra(df.drop(columns='FrameGroup')) 
+            for payload, df in raw.items()}
+    return reference_merge_ballon_data(spec, tolerance_min=1/60)
+
+### CURRENT PATHS ###
+
+def preprocess_spectra(raw:typing.Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    The current fast spectra merge of one day (see run_pairs.preprocess).
+    """
+    spec = {payload:data_preprocessing.repair_timestamps(df) for payload, df in raw.items()}
+    return data_preprocessing.resample_fixed_cadence(
+        data_preprocessing.merge_ballon_grid(spec))
+
+### FIXTURES ###
+
+def synthetic_fixture(hours:float, seed:int=0, cadence_s:float=50E-3) -> typing.Dict:
+    """
+    The raw fast spectra of two payloads with coincident microbursts,
+    data gaps, and time stamps that are out of place (swapped in the
+    file), displaced by whole seconds, and duplicated (a record that
+    repeats the previous record's time stamp). The undisturbed times
+    are the grid times with a record from both payloads that no 
+    disturbed time stamp is on.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(3600*hours/cadence_s)
+    cadence_ns = int(round(cadence_s*1E9))
+    grid = pd.Timestamp('2015-08-26').value + np.arange(n, dtype=np.int64)*cadence_ns
+    counts = rng.poisson(30, (2, n)).astype(float)
+    for start in rng.integers(0, n-10, size=int(20*hours)):
+        # A 0.5 s wide microburst seen by both payloads.
+        counts[:, start:start+10] += 40*np.exp(-((np.arange(10) - 5)/2)**2)
+    counts = np.round(counts)
+
+    undisturbed = np.ones(n, dtype=bool)
+    raw = {}
+    n_disturbed = int(np.ceil(2*hours))
+    for i, payload in enumerate(['3G', '3F']):
+        has_record = np.ones(n, dtype=bool)
+        for start in rng.integers(0, n-100, size=n_disturbed):
+            has_record[start:start+100] = False
+        t = grid.copy()
+        duplicated = rng.choice(np.flatnonzero(has_record[:-1] & has_record[1:]), 
+                                size=n_disturbed, replace=False)
+        t[duplicated+1] = t[duplicated]
+        displaced = rng.choice(np.flatnonzero(has_record), size=n_disturbed, replace=False)
+        t[displaced] += rng.choice([-1, 1], displaced.shape[0])*rng.integers(
+            10, 600, displaced.shape[0])*1_000_000_000
+        landed = (t[displaced] - grid[0])//cadence_ns
+        undisturbed &= has_record
+        for disturbed in [duplicated, duplicated+1, displaced, landed[(landed >= 0) & (landed < n)]]:
+            undisturbed[disturbed] = False
+
+        df = pd.DataFrame({'FSPC1a':counts[i], 'FrameGroup':np.arange(n)}, 
+                        index=pd.to_datetime(t))[has_record]
+        # Swap a few (non-overlapping) pairs of neighboring records in the file.
+        order = np.arange(df.shape[0])
+        swapped = 2*rng.choice(df.shape[0]//2, size=n_disturbed, replace=False)
+        order[swapped], order[swapped+1] = order[swapped+1], order[swapped]
+        raw[payload] = df.iloc[order]
+    return {'name':f'synthetic_{hours:g}h', 'raw':raw, 
+            'undisturbed':pd.to_datetime(grid[undisturbed]), 'fs':preprocess_spectra(raw)}
+
+def recorded_fixture(pair:str, hours:float) -> typing.Dict:
+    """
+    The first hours of a pair's merged fast spectra.
+    """
+    fs = pd.read_csv(pathlib.Path(directories.merged_dir, f'barrel_{pair}_merged_fast_spectra.csv'),
+                    index_col=0, parse_dates=True)
+    fs = fs.loc[:fs.index[0] + pd.Timedelta(hours=hours)]
+    if 'gap' not in fs.columns:
+        fs = data_preprocessing.resample_fixed_cadence(fs)
+    return {'name':f'recorded_{pair}_{hours:g}h', 'raw':None, 'fs':fs}
+
+### CASES ###
+
+def profile(func:typing.Callable, runs:int=3) -> typing.Tuple[typing.Any, float, int]:
+    """
+    Return func's output, its best run time, and its peak traced memory.
+    The memory is measured in a separate run since tracing slows it down.
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return output, min(times), peak
+
+def max_difference(a, b) -> float:
+    """
+    The maximum absolute difference, or inf if the NaNs or shapes differ.
+    """
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    if (a.shape != b.shape) or np.any(np.isnan(a) != np.isnan(b)):
+        return np.inf
+    if a.size == 0 or np.all(np.isnan(a)):
+        return 0.0
+    return float(np.nanmax(np.abs(a - b)))
+
+def detect_events(fs:pd.DataFrame, corr:pd.Series, n_std:pd.DataFrame) -> np.ndarray:
+    d = find_microbursts.Detect(None, None, config)
+    d.fs, d.ephem = fs, pd.DataFrame()
+    d.corr, d.n_std = corr, n_std
+    return d.find_events()['time'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+def undefined_correlations(fs:pd.DataFrame, corr:pd.Series) -> pd.Series:
+    """
+    Set corr to NaN where a channel is constant in the window, e.g. 
+    where the merge repeated a value next to a gap. The correlation is
+    0/0 there, that the rolling.py engines return as NaN and pandas as 
+    round-off.
+    """
+    window = find_microbursts.Detect(None, None, config).correlation_window()
+    constant = np.zeros(fs.shape[0], dtype=bool)
+    for column in [column for column in fs.columns if config['detect_channel'] in column]:
+        rolling_counts = fs[column].rolling(window)
+        constant |= (rolling_counts.max() == rolling_counts.min()).to_numpy()
+    return corr.where(~constant)
+
+def run_detect(fs:pd.DataFrame, path_config:typing.Dict) -> typing.Tuple[pd.Series, pd.DataFrame]:
+    d = find_microbursts.Detect(None, None, {**config, **path_config})
+    d.set_merged_data(fs, pd.DataFrame())
+    d.detect()
+    return d.corr, d.n_std
+
+def run_cases(fixture:typing.Dict, runs:int) -> typing.List[typing.Dict]:
+    """
+    Run every (reference, new) pair of paths on the fixture. The 
+    results with an expected key are the intended differences.
+    """
+    fs = fixture['fs']
+    results = []
+
+    def compare(case, output, reference, new, reference_profile, new_profile):
+        results.append({
+            'fixture':fixture['name'], 'case':case, 'output':output,
+            'max_diff':max_difference(reference, new),
+            'tolerance':tolerances[output],
+            'speedup':reference_profile[1]/new_profile[1],
+            'memory_ratio':new_profile[2]/max(reference_profile[2], 1)
+            })
+        return
+
+    def expected(case, description):
+        results.append({'fixture':fixture['name'], 'case':case, 'expected':description})
+        return
+
+    if fixture['raw'] is not None:
+        reference = profile(lambda: reference_preprocess_spectra(fixture['raw']), runs)
+        new = profile(lambda: preprocess_spectra(fixture['raw']), runs)
+        columns = [column for column in reference[0].columns if 'FSPC' in column]
+        # The original merge has repeated time stamps, all of them disturbed.
+        reference_merged = reference[0][~reference[0].index.duplicated(keep=False)]
+        undisturbed = fixture['undisturbed']
+        compare('timestamp repair, undisturbed', 'merged', 
+                reference_merged.loc[undisturbed, columns].to_numpy(), 
+                new[0].loc[undisturbed, columns].to_numpy(), reference, new)
+
+        disturbed = reference_merged.index.difference(undisturbed).intersection(new[0].index)
+        n_changed = np.any(reference_merged.loc[disturbed, columns].to_numpy() != 
+                            new[0].loc[disturbed, columns].to_numpy(), axis=1).sum()
+        expected('timestamp repair', 
+            f'{reference[0].shape[0]} merged records ({reference[0].index.duplicated().sum()} '
+            f'repeated time stamps) -> {new[0].shape[0]} grid points ({new[0]["gap"].sum()} gaps), '
+            f'{n_changed} of the other {disturbed.shape[0]} shared times changed')
+
+    original = profile(lambda: reference_detect_statistics(fs, config), runs)
+    reference = profile(lambda: run_detect(fs, {'engine':'pandas'}), runs)
+    reference_events = detect_events(fs, *reference[0])
+    # Detect masks both channels' n_std in the windows with a gap in 
+    # either payload, so the n_std is not compared.
+    case = 'Detect engine=pandas vs original'
+    compare(case, 'corr', original[0][0], reference[0][0], original, reference)
+    compare(case, 'event_times', detect_events(fs, *original[0]), reference_events, 
+            original, reference)
+
+    paths = {f'Detect engine={engine}':{'engine':engine} for engine in rolling.engines}
+    for engine in rolling.engines:
+        paths[f'Detect engine={engine}, 4 chunks'] = {'engine':engine, 'n_workers':4}
+    for case, path_config in paths.items():
+        new = profile(lambda: run_detect(fs, path_config), runs)
+        compare(case, 'corr', undefined_correlations(fs, reference[0][0]), 
+                undefined_correlations(fs, new[0][0]), reference, new)
+        compare(case, 'n_std', reference[0][1], new[0][1], reference, new)
+        compare(case, 'event_times', reference_events, detect_events(fs, *new[0]),
+                reference, new)
+    results.append({'fixture':fixture['name'], 'reference_outputs':{
+        'corr':reference[0][0].to_numpy(), 'n_std':reference[0][1].to_numpy(),
+        'event_times':reference_events}})
+    return results
+
+def check_golden(golden_dir:pathlib.Path, name:str, outputs:typing.Dict) -> typing.List[str]:
+    """
+    Save the reference outputs, or return the ones that changed since
+    they were saved.
+    """
+    path = pathlib.Path(golden_dir, f'{name}.npz')
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(path, **outputs)
+        print(f'Saved the golden outputs to {path}')
+        return []
+    golden = np.load(path)
+    return [key for key in outputs
+            if max_difference(golden[key], outputs[key]) > tolerances[key]]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reference vs. optimized regression harness.')
+    parser.add_argument('--hours', type=float, default=2,
+        help='The duration of the synthetic fixture and the recorded fixture excerpts.')
+    parser.add_argument('--recorded', nargs='*', default=[],
+        help='The pairs (e.g. 3g_3f) whose merged csv files are also used as fixtures.')
+    parser.add_argument('--golden', default=None,
+        help='The directory of the saved reference outputs.')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    if 'numba' in rolling.engines:
+        # Compile the kernels before timing them.
+        rolling.baseline_significance(np.ones(10), 2, engine='numba')
+        rolling.rolling_corr(np.ones(10), np.ones(10), 2, engine='numba')
+    else:
+        print('Numba is not installed, so its engine is not checked.')
+
+    fixtures = [synthetic_fixture(args.hours)] + [
+        recorded_fixture(pair, args.hours) for pair in args.recorded]
+    failed = False
+    expected_differences = []
+    print(f'{"fixture":<22} {"case":<32} {"output":<12} {"max diff":>9} {"tolerance":>9} '
+          f'{"pass":>5} {"speedup":>8} {"peak mem":>9}')
+    for fixture in fixtures:
+        for result in run_cases(fixture, args.runs):
+            if 'expected' in result:
+                expected_differences.append(result)
+                continue
+            if 'reference_outputs' in result:
+                if args.golden is not None:
+                    changed = check_golden(args.golden, fixture['name'], result['reference_outputs'])
+                    if len(changed):
+                        failed = True
+                        print(f'{fixture["name"]} reference outputs changed from the golden '
+                              f'outputs: {", ".join(changed)}')
+                continue
+            passed = result['max_diff'] <= result['tolerance']
+            failed |= not passed
+            print(f'{result["fixture"]:<22} {result["case"]:<32} {result["output"]:<12} '
+                  f'{result["max_diff"]:>9.1e} {result["tolerance"]:>9.0e} {str(passed):>5} '
+                  f'{result["speedup"]:>7.1f}x {result["memory_ratio"]:>8.2f}x')
+    print('\nExpected differences from the original code (not checked):')
+    for result in expected_differences:
+        print(f'{result["fixture"]:<22} {result["case"]:<32} {result["expected"]}')
+    sys.exit(int(failed))
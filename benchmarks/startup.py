@@ -0,0 +1,64 @@
+# Measures the startup time of a fresh worker process that imports
+# one of the analysis modules, and reports whether the heavy plotting
+# and cdf backends, or the Numba compiler, were imported as a side 
+# effect. The compute modules should only import NumPy and pandas.
+#
+# Usage (from the top directory): python3 benchmarks/startup.py --runs 20
+
+import argparse
+import json
+import pathlib
+import statistics
+import subprocess
+import sys
+import time
+
+top_dir = pathlib.Path(__file__).resolve().parents[1]
+
+# (module, directory that the module is run from)
+modules = [
+    ('data_preprocessing', top_dir),
+    ('file_catalog', top_dir),
+    ('find_microbursts', top_dir / 'microburst_detection'),
+    ('batch_detect', top_dir / 'microburst_detection'),
+    ]
+heavy_modules = ['matplotlib.pyplot', 'spacepy.pycdf', 'numba']
+
+def time_import(module:str, cwd:pathlib.Path, runs:int) -> dict:
+    """
+    Import the module in runs fresh interpreters and return the wall 
+    times, as well as which of the heavy_modules got imported.
+    """
+    code = (f'import sys, json; sys.path.insert(0, "."); import {module}; '
+            f'print(json.dumps([m for m in {heavy_modules} if m in sys.modules]))')
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', code], cwd=cwd,
+                                capture_output=True, text=True)
+        times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            return {'error':result.stderr.strip().split('\n')[-1]}
+    return {
+        'median_s':statistics.median(times),
+        'min_s':min(times),
+        'heavy_imports':json.loads(result.stdout)
+        }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Worker startup benchmark.')
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    # The bare interpreter startup is the floor that the modules are compared to.
+    baseline = time_import('os', top_dir, args.runs)
+    print(f'{"module":<20} {"median [ms]":>12} {"min [ms]":>10} {"above bare [ms]":>16}  heavy imports')
+    print(f'{"(bare python)":<20} {1E3*baseline["median_s"]:>12.1f} {1E3*baseline["min_s"]:>10.1f}')
+    for module, cwd in modules:
+        result = time_import(module, cwd, args.runs)
+        if 'error' in result:
+            print(f'{module:<20} failed: {result["error"]}')
+            continue
+        print(f'{module:<20} {1E3*result["median_s"]:>12.1f} {1E3*result["min_s"]:>10.1f} '
+              f'{1E3*(result["median_s"]-baseline["median_s"]):>16.1f}  '
+              f'{", ".join(result["heavy_imports"]) or "-"}')
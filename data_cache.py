@@ -0,0 +1,73 @@
+import hashlib
+import os
+import pathlib
+import shutil
+
+import directories
+
+"""
+A size-bounded, least recently used cache of the cdf and merged data
+files in node-local scratch space (directories.scratch_dir), so
+repeated jobs on a node stop re-reading the files from the slow shared
+filesystem. The cache key includes the source file's size and
+modification time, so a changed source file is copied again and its
+stale copy is eventually evicted. The file modification times in the
+cache are the last access times used for the eviction.
+"""
+
+def cached_path(path:pathlib.Path, scratch_dir:pathlib.Path=None,
+                max_size_gb:float=None) -> pathlib.Path:
+    """
+    Return the path of a scratch copy of path, copying it first if it
+    is not cached yet. Returns path itself if there is no scratch
+    directory configured.
+    """
+    scratch_dir = directories.scratch_dir if scratch_dir is None else pathlib.Path(scratch_dir)
+    if max_size_gb is None:
+        max_size_gb = directories.scratch_size_gb
+    path = pathlib.Path(path)
+    if scratch_dir is None:
+        return path
+
+    stat = path.stat()
+    key = hashlib.sha1(
+        f'{path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}'.encode()).hexdigest()[:16]
+    local_path = pathlib.Path(scratch_dir, f'{key}_{path.name}')
+
+    if local_path.exists():
+        # Mark it as recently used.
+        os.utime(local_path)
+        return local_path
+
+    scratch_dir.mkdir(parents=True, exist_ok=True)
+    evict(scratch_dir, int(max_size_gb*1E9) - stat.st_size)
+    # Copy to a process-unique temporary name and rename it so other
+    # processes never see a partial copy.
+    tmp_path = local_path.with_name(f'{local_path.name}.{os.getpid()}.tmp')
+    shutil.copyfile(path, tmp_path)
+    os.replace(tmp_path, local_path)
+    return local_path
+
+def evict(scratch_dir:pathlib.Path, max_bytes:int) -> None:
+    """
+    Delete the least recently used files in scratch_dir until their
+    total size is at most max_bytes.
+    """
+    files = []
+    for entry in os.scandir(scratch_dir):
+        if entry.is_file() and not entry.name.endswith('.tmp'):
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    files.sort()
+
+    total_bytes = sum(size for _, size, _ in files)
+    for _, size, file_path in files:
+        if total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            # Another process evicted it first.
+            pass
+        total_bytes -= size
+    return
@@ -1,11 +1,11 @@
-import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 import os
 import pathlib
 import datetime
 
-import spacepy.pycdf
+# spacepy.pycdf is imported in load_barrel_ephem so the merging and 
+# separation functions can be used without paying for the cdf library.
 
 """
 The two balloons in question are:
@@ -16,36 +16,187 @@ bar_3F_l2_ephm_20150826_v05.cdf
 """
 
 Re_km = 6371
+# The fast spectra channels in energy order, that share their edges
+# (channel i is from edge i to edge i+1 of the FSPC_Edges variable).
+fspc_channels = ['FSPC1a', 'FSPC1b', 'FSPC1c', 'FSPC2', 'FSPC3', 'FSPC4']
 
-def load_barrel_ephem(path, columns='default'):
+def load_barrel_ephem(path, columns='default', time_range=None, 
+                    quality_variable=None, fill_value=-1E31):
     """
     Loads the BARREL ephemeris and saves it to a pandas DataFrame.
+
+    Only the columns variables are read from the cdf file. The fill 
+    values (each variable's FILLVAL attribute, or fill_value if it does
+    not have one) are replaced with NaN in that variable only, and only
+    the records where all of the columns are fill values are dropped.
+    A variable with more than one value per record (e.g. FSPC_Edges) 
+    is split into the <variable>_<i> columns. If quality_variable (e.g. 'Q') is given, the records with a nonzero
+    quality flag are dropped. If time_range is given, only the records 
+    from the first to the last Epoch in time_range are read.
     """
+    import spacepy.pycdf
+
     if columns == 'default':
         columns=['GPS_Alt', 'GPS_Lat', 'GPS_Lon', 'L_Kp2', 
                 'L_Kp6', 'MLT_Kp2_T89c', 'MLT_Kp6_T89c']
 
-    ephem = spacepy.pycdf.CDF(path)
-    ephem_df = pd.DataFrame({key:ephem[key][...] for key in columns}, )
-    ephem_df.replace(-1E31, np.nan, inplace=True)
-    ephem_df.index = ephem['Epoch'][...] 
-    ephem_df.dropna(inplace=True)
+    with spacepy.pycdf.CDF(str(path)) as ephem:
+        # The Epoch variable is read in full to find the records, but it
+        # is one of many variables. The time stamps are not always in
+        # order, so the record range spans every record in time_range.
+        epoch = np.asarray(ephem['Epoch'][...], dtype='datetime64[ns]')
+        i_start, i_end = 0, epoch.shape[0]
+        if time_range is not None:
+            start, end = (np.datetime64(pd.Timestamp(t), 'ns') for t in time_range)
+            in_range = np.flatnonzero((epoch >= start) & (epoch <= end))
+            if in_range.shape[0] == 0:
+                i_start, i_end = 0, 0
+            else:
+                i_start, i_end = in_range[0], in_range[-1]+1
+        epoch = epoch[i_start:i_end]
+        keep = np.ones(epoch.shape[0], dtype=bool)
+        if time_range is not None:
+            keep &= (epoch >= start) & (epoch <= end)
+
+        data = {}
+        for key in columns:
+            variable = ephem[key]
+            values = np.asarray(variable[i_start:i_end])
+            fill = variable.attrs['FILLVAL'] if 'FILLVAL' in variable.attrs else fill_value
+            if not variable.rv():
+                # Repeat the variables that don't vary by record.
+                values = np.broadcast_to(np.asarray(variable[...]), 
+                                        (epoch.shape[0],) + variable.shape)
+            is_fill = values == fill
+            if is_fill.any():
+                values = np.where(is_fill, np.nan, values)
+            if values.ndim == 2:
+                for i in range(values.shape[1]):
+                    data[f'{key}_{i}'] = values[:, i]
+            else:
+                data[key] = values
+
+        if quality_variable is not None:
+            keep &= np.asarray(ephem[quality_variable][i_start:i_end]) == 0
+
+    ephem_df = pd.DataFrame(data, index=epoch)[keep]
+    ephem_df.dropna(how='all', inplace=True)
     return ephem_df
 
-def load_barrel_spectra(path):
+def load_barrel_spectra(path, time_range=None, quality_variable=None, 
+                        edges_variable='FSPC_Edges'):
     """
-    Wrapper to load the BARREL spectra file.
+    Wrapper to load the BARREL spectra file. The channel energy edges
+    of every record, that depend on the payload's gain, are read from 
+    the edges_variable into the edge_<i>_keV columns (see fspc_channels).
     """
-    columns=['FSPC1a', 'FSPC1b', 'FSPC1c', 
-            'FSPC2', 'FSPC3', 'FSPC4']
+    columns = fspc_channels + ['FrameGroup', edges_variable]
 
-    spec = load_barrel_ephem(path, columns=columns)
-    # The BARREL data has time stamps out of place so the sorting 
-    # patches up the problem. I understand that this may be a bad
-    # thing to do.
-    spec.sort_index(inplace=True)
+    spec = load_barrel_ephem(path, columns=columns, time_range=time_range, 
+                            quality_variable=quality_variable)
+    spec = spec.rename(columns=lambda c: 
+        f'edge_{c[len(edges_variable)+1:]}_keV' if c.startswith(f'{edges_variable}_') else c)
+    # The records are put in frame order, so the ones without a frame
+    # counter can't be placed.
+    spec = spec[spec['FrameGroup'].notna()]
+    # The BARREL data has time stamps out of place, duplicated, and 
+    # some that are wildly displaced. A plain sort_index only patches 
+    # the first problem.
+    spec = repair_timestamps(spec)
     return spec
 
+def repair_timestamps(df, cadence_s=50E-3, frame_column='FrameGroup', 
+                    max_offset_s=0.5, median_window=21):
+    """
+    Repairs the BARREL time stamps. The records are put in frame 
+    counter order (file order if there is no frame_column), and a 
+    record is displaced if its time stamp is more than max_offset_s 
+    away from the time expected from its neighbors at the cadence_s 
+    cadence. The displaced time stamps are replaced by the expected 
+    time and then all time stamps are snapped to a cadence_s grid 
+    that is shared by all payloads. Duplicate records on a grid point
+    are resolved by keeping the unrepaired record closest to the grid
+    point (and the first in frame order on ties).
+
+    Returns a time-sorted copy of df with two new columns: time_flag
+    is 1 for the records with repaired time stamps, and gap_before is
+    the number of missing grid points before each record. The number of 
+    displaced and dropped duplicate records are saved in df.attrs.
+    """
+    n = df.shape[0]
+    if n == 0:
+        return df.drop(columns=frame_column, errors='ignore').assign(
+            time_flag=np.array([], dtype=np.int8), 
+            gap_before=np.array([], dtype=np.int64)
+            )
+
+    cadence_ns = int(round(cadence_s*1E9))
+    t = df.index.values.astype('datetime64[ns]').view(np.int64)
+    if frame_column in df.columns:
+        order = np.argsort(df[frame_column].to_numpy(), kind='stable')
+    else:
+        order = np.arange(n)
+    t = t[order]
+
+    # In order, t - i*cadence is constant in continuous stretches of data 
+    # and steps at the data gaps. A centered rolling median removes the
+    # isolated displaced time stamps while keeping the steps. Subtracting
+    # t[0] keeps the nanoseconds exact in the float64 median.
+    i_cadence = np.arange(n, dtype=np.int64)*cadence_ns
+    base = pd.Series((t - t[0] - i_cadence).astype(float))
+    robust_base = base.rolling(median_window, center=True, min_periods=1).median()
+    expected = np.round(robust_base.to_numpy()).astype(np.int64) + i_cadence + t[0]
+    displaced = np.abs(t - expected) > max_offset_s*1E9
+    t = np.where(displaced, expected, t)
+
+    # Snap to the grid, anchored at the Unix epoch so that all payloads 
+    # share it. The stable sort is close to linear for nearly sorted data.
+    slot = (t + cadence_ns//2)//cadence_ns
+    offset = np.abs(t - slot*cadence_ns)
+    by_slot = np.argsort(slot, kind='stable')
+    slot_sorted = slot[by_slot]
+    is_dup = np.concatenate(([False], slot_sorted[1:] == slot_sorted[:-1]))
+    in_dup_group = is_dup | np.concatenate((is_dup[1:], [False]))
+    keep = by_slot[~in_dup_group]
+
+    if in_dup_group.any():
+        # Only the (few) duplicate records need the full tie-breaking sort.
+        candidates = by_slot[in_dup_group]
+        candidates = candidates[np.lexsort((candidates, offset[candidates], 
+                                    displaced[candidates], slot[candidates]))]
+        first = np.concatenate(([True], np.diff(slot[candidates]) != 0))
+        keep = np.concatenate((keep, candidates[first]))
+        keep = keep[np.argsort(slot[keep], kind='stable')]
+
+    repaired = df.iloc[order[keep]].drop(columns=frame_column, errors='ignore')
+    repaired.index = pd.to_datetime(slot[keep]*cadence_ns)
+    repaired['time_flag'] = displaced[keep].astype(np.int8)
+    repaired['gap_before'] = np.concatenate(([0], np.diff(slot[keep]) - 1))
+    repaired.attrs['n_displaced'] = int(displaced.sum())
+    repaired.attrs['n_duplicates'] = int(n - keep.shape[0])
+    return repaired
+
+def resample_fixed_cadence(df, cadence_s=50E-3):
+    """
+    Places df on an exact cadence_s grid (anchored at the Unix epoch)
+    from its first to last time stamp. The grid points without data 
+    are NaN-filled and the boolean gap column is True at the grid 
+    points where any value is missing. With the data on a fixed grid, 
+    a window of N points always spans N*cadence_s seconds.
+    """
+    cadence_ns = int(round(cadence_s*1E9))
+    t = df.index.values.astype('datetime64[ns]').view(np.int64)
+    slot = (t + cadence_ns//2)//cadence_ns
+    df = df.set_axis(pd.to_datetime(slot*cadence_ns), axis=0)
+    df = df[~df.index.duplicated(keep='first')]
+
+    if df.shape[0] == 0:
+        return df.assign(gap=np.array([], dtype=bool))
+    grid = pd.to_datetime(np.arange(slot.min(), slot.max()+1)*cadence_ns)
+    df = df.reindex(grid)
+    df['gap'] = df.isna().any(axis=1).to_numpy()
+    return df
+
 def merge_ballon_data(ephem, tolerance_min=5):
     """
     Merge the balloons DataFrames by time. Ephem is a dictionary 
@@ -69,6 +220,21 @@ def merge_ballon_data(ephem, tolerance_min=5):
                                 tolerance=pd.Timedelta(minutes=tolerance_min))
     return merged_df
 
+def merge_ballon_grid(spec):
+    """
+    Merge the balloons' fast spectra DataFrames on their shared 
+    cadence grid (see repair_timestamps). Spec is a dictionary of 
+    DataFrames. Only the exactly matching time stamps are merged, so 
+    a record that is missing from either balloon is NaN instead of a 
+    repeated neighboring record, and resample_fixed_cadence marks it 
+    as a gap.
+    """
+    assert len(spec.keys()) == 2, (f'Can only merge 2 DataFrames. '
+                                    f'Got {len(spec.keys())}')
+    merged_df = pd.concat([df.add_prefix(f'{payload}_') for payload, df in spec.items()], 
+                        axis=1, join='outer')
+    return merged_df.sort_index()
+
 def merge_ballon_times(ephem):
     """
     Concatenate the ephemeris over multiple days.
@@ -92,7 +258,9 @@ def haversine(X1, X2):
 
 if __name__ == '__main__':
     ### EXAMPLE CODE ###
-    data_dir = '/home/mike/research/barrel/data/campaign_3'
+    import directories
+
+    data_dir = pathlib.Path(directories.data_dir, 'campaign_3')
     match_name = 'bar_*_l2_fspc_*.cdf'
 
     flight_dates = ['20150825', '20150826']
@@ -122,6 +290,7 @@ if __name__ == '__main__':
     merged_fs = merge_ballon_times(merged_fs)
     
     
-    path = ('/home/mike/research/barrel/data/campaign_3/3G/150825/'
-            'bar_3G_l2_ephm_20150825_v05.cdf')
-    df, time = load_barrel_ephem(path)
+    path = pathlib.Path(data_dir, '3G', '150825', 'bar_3G_l2_ephm_20150825_v05.cdf')
+    # Read only the GPS variables in a one hour window.
+    df = load_barrel_ephem(path, columns=['GPS_Lat', 'GPS_Lon', 'GPS_Alt'],
+                            time_range=['20150825T10:00:00', '20150825T11:00:00'])
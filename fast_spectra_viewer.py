@@ -0,0 +1,199 @@
+# Interactive viewer for browsing a whole flight of merged fast spectra.
+# The full resolution data is kept in NumPy arrays and on every zoom
+# or pan only the visible time range is sent to matplotlib, decimated
+# to the min and max of every screen pixel, so the spikes are never
+# lost and the redraw cost does not depend on the flight duration.
+# The payload panels share the time axis and the ephemeris values under
+# the cursor are shown while hovering.
+#
+# The fast spectra can also be a merged_store.py store. Then only a
+# coarse min/max overview of the flight is kept in memory and, once
+# the visible range is zoomed in past the overview resolution, the
+# visible range is read from the overlapping store segments.
+#
+# Run with an interactive (e.g. QtAgg) matplotlib backend.
+
+import pathlib
+import typing
+
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+import matplotlib.dates
+from pandas.plotting import register_matplotlib_converters
+register_matplotlib_converters()
+
+import directories
+import merged_store
+
+def min_max_decimate(t:np.ndarray, y:np.ndarray, n_bins:int
+                    ) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    Decimate y to the minimum and maximum in each of n_bins equal
+    length bins. Returns the (t, y) points that draw a vertical segment
+    for every bin. If there are fewer than 2*n_bins points, y is
+    returned as is.
+    """
+    if t.shape[0] <= 2*n_bins:
+        return t, y
+    edges = np.linspace(0, t.shape[0], n_bins+1).astype(int)[:-1]
+    # fmin/fmax ignore the NaN gaps unless the whole bin is a gap.
+    y_min = np.fmin.reduceat(y, edges)
+    y_max = np.fmax.reduceat(y, edges)
+    return np.repeat(t[edges], 2), np.column_stack((y_min, y_max)).ravel()
+
+class FastSpectraViewer:
+    def __init__(self, fs:typing.Union[pd.DataFrame, merged_store.MergedStore],
+                ephem:pd.DataFrame, payloads:typing.List[str],
+                ephem_variables:typing.List[str]=None, overview_s:float=1) -> None:
+        """
+        Make the viewer with one panel per payload showing its FSPC
+        channels. ephem_variables are the ephemeris columns shown under
+        the cursor (all of them by default). If fs is a MergedStore,
+        the flight is kept as an overview with the min and max of every
+        overview_s seconds and the zoomed in ranges are read from the
+        store.
+        """
+        self.payloads = payloads
+        if isinstance(fs, merged_store.MergedStore):
+            self.store = fs
+            columns = self.store.segments()[0]['columns']
+        else:
+            self.store = None
+            columns = list(fs.columns)
+        self.channels = {payload:[column for column in columns
+                                if column.startswith(f'{payload}_FSPC')]
+                        for payload in payloads}
+        self.overview_s = overview_s
+        # The (x_min, x_max, t, values) of the last range read from the store.
+        self.cache = None
+        if self.store is None:
+            self.t = matplotlib.dates.date2num(fs.index)
+            self.values = {column:fs[column].to_numpy(dtype=float)
+                            for columns in self.channels.values() for column in columns}
+        else:
+            self.t, self.values = self.read_overview()
+
+        if ephem_variables is None:
+            ephem_variables = list(ephem.columns)
+        self.ephem_variables = ephem_variables
+        self.ephem_t = matplotlib.dates.date2num(ephem.index)
+        self.ephem_values = ephem[ephem_variables].to_numpy(dtype=float)
+
+        self.fig, self.ax = plt.subplots(len(payloads), 1, sharex=True, figsize=(12, 6))
+        self.lines = {}
+        for ax, payload in zip(self.ax, payloads):
+            for column in self.channels[payload]:
+                self.lines[column], = ax.plot([], [], label=column)
+            ax.legend(loc=1)
+            ax.set_ylabel('Counts')
+        self.cursor_lines = [ax.axvline(self.t[0], c='k', lw=0.5) for ax in self.ax]
+        self.cursor_text = self.ax[0].text(0.01, 0.97, '', transform=self.ax[0].transAxes,
+                                        va='top', fontsize=8, family='monospace',
+                                        bbox={'facecolor':'w', 'alpha':0.8})
+        self.ax[-1].xaxis.set_major_formatter(matplotlib.dates.DateFormatter('%m/%d\n%H:%M:%S'))
+        self.ax[-1].set_xlabel('UTC')
+        self.ax[0].set_title(f'BARREL {" and ".join(payloads)} fast spectra')
+
+        self.ax[0].callbacks.connect('xlim_changed', self.update_lines)
+        self.fig.canvas.mpl_connect('motion_notify_event', self.on_mouse_move)
+        self.fig.canvas.mpl_connect('resize_event', lambda event: self.update_lines(self.ax[0]))
+        self.ax[0].set_xlim(self.t[0], self.t[-1])
+        for ax in self.ax:
+            ax.autoscale(axis='y')
+        return
+
+    def read_overview(self) -> typing.Tuple[np.ndarray, typing.Dict[str, np.ndarray]]:
+        """
+        Read the store one segment at a time and decimate each segment
+        to the min and max of every overview_s seconds.
+        """
+        t = []
+        values = {column:[] for columns in self.channels.values() for column in columns}
+        for segment in self.store.segments():
+            df = self.store.read(segment['start'], segment['end'], list(values))
+            segment_t = matplotlib.dates.date2num(df.index)
+            n_bins = max(int((segment_t[-1] - segment_t[0])*86400/self.overview_s), 1)
+            for column in values:
+                segment_t_decimated, y = min_max_decimate(
+                    segment_t, df[column].to_numpy(dtype=float), n_bins)
+                values[column].append(y)
+            t.append(segment_t_decimated)
+        return np.concatenate(t), {column:np.concatenate(y) for column, y in values.items()}
+
+    def visible_data(self, x_min:float, x_max:float, n_bins:int
+                    ) -> typing.Tuple[np.ndarray, typing.Dict[str, np.ndarray]]:
+        """
+        The arrays to decimate for the x_min to x_max range: the full
+        resolution data, the store overview, or, when the overview is
+        coarser than a screen pixel, the range read from the store.
+        """
+        if (self.store is None) or ((x_max - x_min)*86400 > n_bins*self.overview_s):
+            return self.t, self.values
+        if (self.cache is None) or (x_min < self.cache[0]) or (x_max > self.cache[1]):
+            # Read a margin on both sides so small pans don't reread the store.
+            margin = x_max - x_min
+            start, end = x_min - margin, x_max + margin
+            df = self.store.read(matplotlib.dates.num2date(start).replace(tzinfo=None),
+                                matplotlib.dates.num2date(end).replace(tzinfo=None),
+                                list(self.values))
+            self.cache = (start, end, matplotlib.dates.date2num(df.index),
+                        {column:df[column].to_numpy(dtype=float) for column in self.values})
+        return self.cache[2], self.cache[3]
+
+    def update_lines(self, ax) -> None:
+        """
+        Fetch the visible time range at the screen resolution.
+        """
+        x_min, x_max = ax.get_xlim()
+        n_bins = max(int(ax.bbox.width), 1)
+        t, values = self.visible_data(x_min, x_max, n_bins)
+        i_start = max(np.searchsorted(t, x_min) - 1, 0)
+        i_end = min(np.searchsorted(t, x_max) + 1, t.shape[0])
+
+        for column, line in self.lines.items():
+            line.set_data(*min_max_decimate(t[i_start:i_end],
+                            values[column][i_start:i_end], n_bins))
+        for a in self.ax:
+            a.relim()
+            a.autoscale_view(scalex=False)
+        self.fig.canvas.draw_idle()
+        return
+
+    def on_mouse_move(self, event) -> None:
+        """
+        Draw the cursor line through both panels and show the nearest
+        ephemeris values.
+        """
+        if event.inaxes is None or event.xdata is None:
+            return
+        for line in self.cursor_lines:
+            line.set_xdata([event.xdata, event.xdata])
+
+        i = np.clip(np.searchsorted(self.ephem_t, event.xdata), 1, self.ephem_t.shape[0]-1)
+        i -= (event.xdata - self.ephem_t[i-1]) < (self.ephem_t[i] - event.xdata)
+        time = matplotlib.dates.num2date(event.xdata).strftime('%Y-%m-%d %H:%M:%S.%f')[:-4]
+        self.cursor_text.set_text('\n'.join(
+            [time] + [f'{name:<16} {value:.2f}'
+                        for name, value in zip(self.ephem_variables, self.ephem_values[i])]
+            ))
+        self.fig.canvas.draw_idle()
+        return
+
+if __name__ == '__main__':
+    fs_path = pathlib.Path(directories.merged_dir, 'barrel_3g_3f_merged_fast_spectra')
+    ephem_path = pathlib.Path(directories.merged_dir, 'barrel_3g_3f_merged_ephemeris')
+    ephem_variables = ['3G_L_Kp2', '3G_MLT_Kp2_T89c', '3G_GPS_Alt', '3F_GPS_Alt', 'dist_km']
+
+    # Prefer the merged stores (run_pairs.py --append) over the merged csv files.
+    if fs_path.is_dir():
+        fs = merged_store.MergedStore(fs_path)
+    else:
+        fs = pd.read_csv(fs_path.with_suffix('.csv'), index_col=0, parse_dates=True)
+    if ephem_path.is_dir():
+        ephem = merged_store.MergedStore(ephem_path).read(columns=ephem_variables)
+    else:
+        ephem = pd.read_csv(ephem_path.with_suffix('.csv'), index_col=0, parse_dates=True)
+
+    viewer = FastSpectraViewer(fs, ephem, ['3G', '3F'], ephem_variables=ephem_variables)
+    plt.show()
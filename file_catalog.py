@@ -0,0 +1,195 @@
+import concurrent.futures
+import json
+import os
+import pathlib
+import re
+import typing
+
+import pandas as pd
+
+import data_cache
+import directories
+
+"""
+Scans the BARREL cdf archive once into an index of
+(campaign, payload, product, date, version, path) rows so the scripts
+don't need to walk the (network-mounted) archive every time they run.
+The files are then loaded concurrently with a thread pool so the file
+I/O overlaps with the parsing.
+
+The BARREL file names look like bar_3G_l2_ephm_20150825_v05.cdf
+
+The modification times of the archive directories are saved next to
+the index. Adding or removing a file (e.g. a new _v06 version or a new
+flight day) changes its directory's modification time, so load_index
+only needs to stat the directories to find the ones to rescan.
+"""
+
+file_name_pattern = re.compile(
+    r'bar_(?P<payload>[0-9][A-Z])_l2_(?P<product>[a-z]+)_'
+    r'(?P<date>\d{8})_v(?P<version>\d+)\.cdf$'
+    )
+campaign_dir_pattern = re.compile(r'campaign_(?P<campaign>\d+)$')
+index_columns = ['campaign', 'payload', 'product', 'date', 'version', 'path']
+default_index_path = pathlib.Path(directories.merged_dir, 'barrel_cdf_index.csv')
+
+def scan_archive(archive_dir:str) -> pd.DataFrame:
+    """
+    Walk the archive once and parse every BARREL cdf file name. The
+    campaign number comes from the campaign_N directory if there is
+    one, otherwise from the first character of the payload id.
+    """
+    rows, _ = _scan_directories([str(archive_dir)], {})
+    return _to_index(rows)
+
+def load_index(archive_dir:str, index_path:pathlib.Path=default_index_path,
+                rescan:bool=False) -> pd.DataFrame:
+    """
+    Load the archive index from index_path, or scan the archive and
+    save the index if it does not exist yet. The directories that
+    changed since the index was saved are rescanned. Set rescan=True to
+    rescan the whole archive.
+    """
+    archive_dir = str(archive_dir)
+    index_path = pathlib.Path(index_path)
+    directories_path = index_path.with_name(f'{index_path.stem}_directories.json')
+
+    if index_path.exists() and directories_path.exists() and not rescan:
+        with open(directories_path) as f:
+            saved = json.load(f)
+        if saved['archive_dir'] == archive_dir:
+            mtimes = saved['mtimes']
+            changed = [directory for directory, mtime in mtimes.items() 
+                        if _mtime(directory) != mtime]
+            index = pd.read_csv(index_path, dtype={'payload':str, 'product':str,
+                                                'date':str, 'path':str})
+            if len(changed) == 0:
+                return index
+            # Keep the rows of the unchanged directories and rescan the
+            # changed ones (and their new subdirectories).
+            index = index[~index['path'].map(os.path.dirname).isin(changed)]
+            mtimes = {directory:mtime for directory, mtime in mtimes.items()
+                        if directory not in changed}
+            rows, new_mtimes = _scan_directories(
+                [directory for directory in changed if os.path.isdir(directory)], mtimes)
+            index = _to_index(list(index.itertuples(index=False, name=None)) + rows)
+            _save_index(index, index_path, directories_path, archive_dir, 
+                        {**mtimes, **new_mtimes})
+            return index
+
+    rows, mtimes = _scan_directories([archive_dir], {})
+    index = _to_index(rows)
+    _save_index(index, index_path, directories_path, archive_dir, mtimes)
+    return index
+
+def _scan_directories(roots:typing.List[str], known:typing.Dict[str, int]
+                    ) -> typing.Tuple[typing.List[tuple], typing.Dict[str, int]]:
+    """
+    Parse the cdf file names in the roots and in their subdirectories
+    that are not in known (those are checked on their own). Returns 
+    the index rows and the modification times of the scanned directories.
+    """
+    rows = []
+    mtimes = {}
+    roots = list(roots)
+    while len(roots):
+        root = roots.pop()
+        mtimes[root] = _mtime(root)
+        campaign = None
+        for part in pathlib.Path(root).parts[::-1]:
+            match = campaign_dir_pattern.match(part)
+            if match is not None:
+                campaign = int(match['campaign'])
+                break
+
+        with os.scandir(root) as entries:
+            for entry in entries:
+                path = os.path.join(root, entry.name)
+                if entry.is_dir():
+                    if path not in known:
+                        roots.append(path)
+                    continue
+                match = file_name_pattern.match(entry.name)
+                if match is None:
+                    continue
+                rows.append((
+                    campaign if campaign is not None else int(match['payload'][0]),
+                    match['payload'],
+                    match['product'],
+                    match['date'],
+                    int(match['version']),
+                    path
+                    ))
+    return rows, mtimes
+
+def _to_index(rows:typing.List[tuple]) -> pd.DataFrame:
+    index = pd.DataFrame(rows, columns=index_columns)
+    index.sort_values(['date', 'payload', 'product', 'version', 'path'],
+                    inplace=True, ignore_index=True)
+    return index
+
+def _save_index(index:pd.DataFrame, index_path:pathlib.Path, directories_path:pathlib.Path,
+                archive_dir:str, mtimes:typing.Dict[str, int]) -> None:
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    index.to_csv(index_path, index=False)
+    with open(directories_path, 'w') as f:
+        json.dump({'archive_dir':archive_dir, 'mtimes':mtimes}, f)
+    return
+
+def _mtime(directory:str) -> typing.Optional[int]:
+    try:
+        return os.stat(directory).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def select(index:pd.DataFrame, product:str, dates:typing.List[str]=None,
+            payloads:typing.List[str]=None, campaign:int=None) -> pd.DataFrame:
+    """
+    Select the latest version of the product files, optionally only
+    for the given dates, payloads, and campaign. The payloads are
+    returned in the order that they are given.
+    """
+    selected = index[index['product'] == product]
+    if dates is not None:
+        selected = selected[selected['date'].isin(dates)]
+    if payloads is not None:
+        selected = selected[selected['payload'].isin(payloads)]
+    if campaign is not None:
+        selected = selected[selected['campaign'] == campaign]
+
+    # Keep the latest version of every (payload, product, date) file.
+    selected = selected.sort_values('version').drop_duplicates(
+        ['payload', 'product', 'date'], keep='last')
+
+    if payloads is not None:
+        payload_order = selected['payload'].map({p:i for i, p in enumerate(payloads)})
+        selected = selected.assign(_order=payload_order).sort_values(
+            ['date', '_order']).drop(columns='_order')
+    else:
+        selected = selected.sort_values(['date', 'payload'])
+    return selected.reset_index(drop=True)
+
+def load_files(paths:typing.Iterable[str], loader:typing.Callable,
+                n_threads:int=8) -> typing.List:
+    """
+    Call loader on every path with a thread pool and return the
+    results in the same order as paths. The files are read from the
+    node-local scratch cache if directories.scratch_dir is set.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_threads) as executor:
+        return list(executor.map(
+            lambda path: loader(str(data_cache.cached_path(path))), paths))
+
+def load_by_date(selected:pd.DataFrame, loader:typing.Callable,
+                n_threads:int=8) -> typing.Dict[str, typing.Dict[str, pd.DataFrame]]:
+    """
+    Load the selected files concurrently into a dictionary of
+    dictionaries. The parent level dictionary has the dates and the
+    child dictionary has the payloads that flew on those days. This is
+    the structure that data_preprocessing.merge_ballon_data expects.
+    """
+    data = load_files(selected['path'], loader, n_threads=n_threads)
+    by_date = {}
+    for date, payload, df in zip(selected['date'], selected['payload'], data):
+        by_date.setdefault(date, {})[payload] = df
+    return by_date
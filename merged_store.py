@@ -0,0 +1,161 @@
+import json
+import os
+import pathlib
+import typing
+
+import numpy as np
+import pandas as pd
+
+import provenance
+
+"""
+An append-only store of merged data, with one sorted csv segment per
+UTC day and a manifest.json that lists the segments and their time
+ranges. Appending a day only writes that day's segment and the small
+manifest, instead of concatenating and rewriting the whole flight like
+merge_ballon_times and to_csv do. Reappending a day replaces its
+segment, e.g. after a new cdf version. Each segment's manifest entry
+has the same provenance as a merged csv file's sidecar (see 
+provenance.py): the schema, the fingerprints of its source files, its
+merge parameters, and the column checksums. is_fresh tells which days
+need to be merged and reappended, and verify checks a segment's data.
+
+The reader returns one time-ordered DataFrame from the segments that
+overlap the requested time range. The flights cross midnight UTC, so
+neighboring segments can overlap. A time stamp in more than one segment
+is taken from the segment of its own UTC day.
+"""
+
+manifest_name = 'manifest.json'
+
+class MergedStore:
+    def __init__(self, directory:pathlib.Path) -> None:
+        """
+        Open (or create) the store in directory.
+        """
+        self.directory = pathlib.Path(directory)
+        self.manifest_path = pathlib.Path(self.directory, manifest_name)
+        if self.manifest_path.exists():
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {'segments':[]}
+        return
+
+    def append(self, date:str, df:pd.DataFrame, sources:typing.List[pathlib.Path]=None,
+                params:typing.Dict=None) -> pathlib.Path:
+        """
+        Write the merged data of one date (YYYYMMDD) as a sorted
+        segment and register it in the manifest with the source files
+        and the (json serializable) params it was merged with.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        df = df.sort_index(kind='stable')
+        path = pathlib.Path(self.directory, f'segment_{date}.csv')
+        tmp_path = path.with_name(f'{path.name}.tmp')
+        df.to_csv(tmp_path, index_label='Time')
+        os.replace(tmp_path, path)
+
+        segment = {
+            'date':date,
+            'file':path.name,
+            'start':df.index[0].isoformat() if df.shape[0] else None,
+            'end':df.index[-1].isoformat() if df.shape[0] else None,
+            'n_rows':df.shape[0],
+            'columns':list(df.columns),
+            'schema':provenance.schema(df),
+            'checksums':provenance.column_checksums(df),
+            'params':params,
+            'sources':[provenance.fingerprint(source) for source in sorted(map(str, sources or []))],
+            'output':provenance.fingerprint(path)
+            }
+        self.manifest['segments'] = sorted(
+            [s for s in self.manifest['segments'] if s['date'] != date] + [segment],
+            key=lambda s: s['date'])
+        self._write_manifest()
+        return path
+
+    def is_fresh(self, date:str, sources:typing.List[pathlib.Path], params:typing.Dict) -> bool:
+        """
+        True if the date's segment was made from the same (unchanged)
+        source files with the same params, and was not modified since.
+        Only the file stats are compared (see provenance.is_fresh).
+        """
+        for segment in self.manifest['segments']:
+            if segment['date'] == date:
+                return provenance.matches(segment, pathlib.Path(self.directory, segment['file']), 
+                                        sources, params)
+        return False
+
+    def verify(self, date:str) -> typing.List[str]:
+        """
+        Return the columns of the date's segment whose checksums don't
+        match the manifest. Unlike is_fresh this reads the segment.
+        """
+        segment = [segment for segment in self.manifest['segments'] if segment['date'] == date]
+        assert len(segment) == 1, f'{date} is not in the {self.directory} store.'
+        return provenance.verify_metadata(segment[0], 
+                                        pathlib.Path(self.directory, segment[0]['file']))
+
+    def dates(self) -> typing.List[str]:
+        return [segment['date'] for segment in self.manifest['segments']]
+
+    def segments(self, start:str=None, end:str=None) -> typing.List[typing.Dict]:
+        """
+        The manifest entries of the non-empty segments that overlap
+        the start to end time range (inclusive, None is open-ended).
+        """
+        start = pd.Timestamp(start) if start is not None else None
+        end = pd.Timestamp(end) if end is not None else None
+        return [
+            segment for segment in self.manifest['segments']
+            if (segment['n_rows'] > 0) and
+                ((end is None) or (pd.Timestamp(segment['start']) <= end)) and
+                ((start is None) or (pd.Timestamp(segment['end']) >= start))
+            ]
+
+    def overlaps(self) -> typing.List[typing.Tuple[str, str]]:
+        """
+        The dates of the neighboring segments whose time ranges overlap.
+        """
+        segments = self.segments()
+        return [(a['date'], b['date']) for a, b in zip(segments[:-1], segments[1:])
+                if pd.Timestamp(b['start']) <= pd.Timestamp(a['end'])]
+
+    def read(self, start:str=None, end:str=None,
+            columns:typing.List[str]=None) -> pd.DataFrame:
+        """
+        Read the start to end time range of the store as one
+        time-ordered DataFrame. Only the overlapping segments are read.
+        """
+        dfs = []
+        for segment in self.segments(start, end):
+            df = pd.read_csv(pathlib.Path(self.directory, segment['file']), index_col=0,
+                            parse_dates=True,
+                            usecols=None if columns is None else lambda c: c in ['Time'] + columns)
+            # Keep the rows that are on the segment's own UTC day first.
+            df['_own_day'] = df.index.normalize() == pd.Timestamp(segment['date'])
+            dfs.append(df.loc[start:end])
+        if len(dfs) == 0:
+            return pd.DataFrame()
+
+        df = pd.concat(dfs)
+        if not (df.index.is_monotonic_increasing and df.index.is_unique):
+            # Only the overlapping segments need the sort. The segments 
+            # are in date order, so the stable sort keeps the earlier 
+            # segment first when neither segment owns a duplicate time.
+            order = np.lexsort((~df['_own_day'].to_numpy(), 
+                                df.index.values.astype('datetime64[ns]')))
+            df = df.iloc[order]
+            df = df[~df.index.duplicated(keep='first')]
+        return df.drop(columns='_own_day')
+
+    def _write_manifest(self) -> None:
+        """
+        Atomically replace the manifest so readers never see a partial one.
+        """
+        tmp_path = self.manifest_path.with_name(f'{manifest_name}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+        return
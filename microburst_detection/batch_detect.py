@@ -0,0 +1,172 @@
+# Headless microburst detection over a list of (pair, time_range) jobs,
+# for example every conjunction interval in a campaign. The jobs are
+# run in a process pool, every finished job is checkpointed to its own
+# csv file, and a rerun skips the jobs that already have a checkpoint.
+# The checkpoint names include a key of the merged data (from its 
+# provenance.py sidecar) and the detection config, so the checkpoints
+# are rerun when the merged data is remade or the config changes.
+# The checkpoints are then consolidated into one event catalog.
+#
+# Usage: python3 batch_detect.py batch_jobs.json --workers 32 --max_memory_gb 4
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import pathlib
+import resource
+import typing
+
+import pandas as pd
+
+import directories
+import event_catalog
+import find_microbursts
+# provenance is in the top directory that find_microbursts adds to the path.
+import provenance
+
+default_config = {
+    'baseline_width_min':5,
+    'baseline_std_thresh':2,
+    'correlation_width_s':1,
+    'correlation_thresh':0.8,
+    'detect_channel':'FSPC1a'
+    }
+
+def load_jobs(path:pathlib.Path) -> typing.List[typing.Dict]:
+    """
+    Load the jobs json file. It must contain a list of jobs, each with
+    a pair key (e.g. "3g_3f") and a time_range key with the start and
+    end times. A job can override the default config with a config key.
+    """
+    with open(path) as f:
+        jobs = json.load(f)
+    for job in jobs:
+        assert ('pair' in job) and ('time_range' in job), (
+            f'A job needs a pair and a time_range. Got {job=}')
+    return jobs
+
+def job_id(job:typing.Dict) -> str:
+    """
+    A unique and file name safe id for the job.
+    """
+    start, end = [pd.Timestamp(t).strftime('%Y%m%dT%H%M%S') for t in job['time_range']]
+    return f'{job["pair"].lower()}_{start}_{end}'
+
+def job_paths(job:typing.Dict) -> typing.Tuple[pathlib.Path, pathlib.Path]:
+    """
+    The merged fast spectra and ephemeris paths of the job's pair.
+    """
+    return (pathlib.Path(directories.merged_dir, f'barrel_{job["pair"].lower()}_merged_fast_spectra.csv'),
+            pathlib.Path(directories.merged_dir, f'barrel_{job["pair"].lower()}_merged_ephemeris.csv'))
+
+def checkpoint_name(job:typing.Dict, config:typing.Dict) -> str:
+    """
+    The job_id and a key of the job's merged data and detection config.
+    """
+    inputs = [provenance.content_key(path) if path.exists() else None 
+                for path in job_paths(job)]
+    key = json.dumps([inputs, {**config, **job.get('config', {})}], sort_keys=True)
+    return f'{job_id(job)}_{hashlib.sha1(key.encode()).hexdigest()[:12]}'
+
+def run_job(job:typing.Dict, config:typing.Dict) -> pd.DataFrame:
+    """
+    Run Detect on one job and return the detected events.
+    """
+    config = {**config, **job.get('config', {}), 'time_range':job['time_range']}
+    fs_path, ephem_path = job_paths(job)
+    d = find_microbursts.Detect(fs_path, ephem_path, config)
+    d.detect()
+    events = d.find_events()
+    events.insert(0, 'pair', job['pair'].lower())
+    events.insert(1, 'job_id', job_id(job))
+    return events
+
+def limit_memory(max_memory_gb:float) -> None:
+    """
+    Process pool initializer that caps the worker's address space so
+    a job that runs away raises a MemoryError instead of taking down
+    the whole node.
+    """
+    if max_memory_gb is not None:
+        max_bytes = int(max_memory_gb*1E9)
+        resource.setrlimit(resource.RLIMIT_AS, (max_bytes, max_bytes))
+    return
+
+def run_batch(jobs:typing.List[typing.Dict], config:typing.Dict,
+            checkpoint_dir:pathlib.Path, catalog_path:pathlib.Path,
+            n_workers:int=None, max_memory_gb:float=None,
+            catalog_db:event_catalog.EventCatalog=None) -> pd.DataFrame:
+    """
+    Run the jobs that don't have a checkpoint yet, and consolidate all
+    of the checkpoints into one event catalog sorted by time. If 
+    catalog_db is given, every finished job's events are also appended
+    to that indexed catalog.
+    """
+    checkpoint_dir = pathlib.Path(checkpoint_dir)
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    checkpoints = {job_id(job):pathlib.Path(checkpoint_dir, f'{checkpoint_name(job, config)}.csv')
+                    for job in jobs}
+    pending = [job for job in jobs if not checkpoints[job_id(job)].exists()]
+    print(f'{len(jobs)-len(pending)} of {len(jobs)} jobs already checkpointed.')
+
+    failed = []
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=n_workers, initializer=limit_memory,
+            initargs=(max_memory_gb,)) as executor:
+        futures = {executor.submit(run_job, job, config):job for job in pending}
+        for future in concurrent.futures.as_completed(futures):
+            job = futures[future]
+            try:
+                events = future.result()
+            except Exception as err:
+                # BrokenProcessPool also ends up here if a worker was killed.
+                # Its job and the remaining ones will be rerun on resume.
+                print(f'Job {job_id(job)} failed: {err!r}')
+                failed.append(job)
+                continue
+            # Write to a temporary file first so a crash mid-write does not
+            # leave a partial checkpoint behind.
+            checkpoint_path = checkpoints[job_id(job)]
+            tmp_path = checkpoint_path.with_suffix('.tmp')
+            events.to_csv(tmp_path, index=False)
+            if catalog_db is not None:
+                # Append before the checkpoint exists, so a crash in 
+                # between reruns the job. The append replaces the job's
+                # previous events, so the rerun does not duplicate them.
+                catalog_db.append(events, job_id=job_id(job))
+            tmp_path.replace(checkpoint_path)
+            print(f'Job {job_id(job)} found {events.shape[0]} events.')
+
+    if len(failed):
+        print(f'{len(failed)} jobs failed. Rerun to resume them.')
+
+    catalog = pd.concat(
+        [pd.DataFrame(columns=['pair', 'job_id', 'time'])] + 
+        [pd.read_csv(path, parse_dates=['time', 'start', 'end'])
+            for path in checkpoints.values() if path.exists()],
+        ignore_index=True
+        )
+    catalog.sort_values('time', inplace=True, ignore_index=True)
+    catalog.to_csv(catalog_path, index=False)
+    return catalog
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batch BARREL microburst detection.')
+    parser.add_argument('jobs_path', help='The json file with the detection jobs.')
+    parser.add_argument('--workers', type=int, default=None,
+        help='Number of worker processes. Defaults to the number of cores.')
+    parser.add_argument('--max_memory_gb', type=float, default=None,
+        help='Memory limit of each worker process.')
+    parser.add_argument('--checkpoint_dir', default=pathlib.Path(directories.merged_dir, 'detection_checkpoints'))
+    parser.add_argument('--catalog_path', default=pathlib.Path(directories.merged_dir, 'barrel_microburst_catalog.csv'))
+    parser.add_argument('--catalog_db', default=event_catalog.default_catalog_path,
+        help='The SQLite event catalog that the events are also appended to.')
+    args = parser.parse_args()
+
+    with event_catalog.EventCatalog(args.catalog_db) as catalog_db:
+        catalog = run_batch(load_jobs(args.jobs_path), default_config,
+                            args.checkpoint_dir, args.catalog_path,
+                            n_workers=args.workers, max_memory_gb=args.max_memory_gb,
+                            catalog_db=catalog_db)
+    print(f'Saved {catalog.shape[0]} events to {args.catalog_path}')
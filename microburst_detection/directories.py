@@ -1,2 +1,30 @@
-top_dir = '/home/mike/research/barrel/barrel_proximity_flights/'
-data_dir = '/home/mike/research/barrel/data/'
\ No newline at end of file
+import os
+import pathlib
+
+"""
+Resolves the data directories so nothing is hard-coded to one machine.
+This is the microburst_detection/ copy of the top directory one.
+Override the defaults with environment variables:
+
+BARREL_TOP_DIR:     This project's directory, where merged_data/ and 
+                    plots/ are saved. Defaults to the parent of this
+                    file's directory.
+BARREL_DATA_DIR:    The BARREL cdf archive (e.g. a shared, read-only 
+                    filesystem). Defaults to the data/ directory next 
+                    to BARREL_TOP_DIR.
+BARREL_SCRATCH_DIR: An optional node-local scratch directory that the
+                    frequently used cdf and merged files are cached in
+                    (see data_cache.py). No caching if it is not set.
+BARREL_SCRATCH_GB:  The scratch cache size limit. Defaults to 50 GB.
+"""
+
+top_dir = pathlib.Path(os.environ.get('BARREL_TOP_DIR', 
+                                    pathlib.Path(__file__).resolve().parents[1]))
+data_dir = pathlib.Path(os.environ.get('BARREL_DATA_DIR', top_dir.parent / 'data'))
+merged_dir = top_dir / 'merged_data'
+plots_dir = top_dir / 'plots'
+
+scratch_dir = os.environ.get('BARREL_SCRATCH_DIR')
+if scratch_dir is not None:
+    scratch_dir = pathlib.Path(scratch_dir)
+scratch_size_gb = float(os.environ.get('BARREL_SCRATCH_GB', 50))
@@ -0,0 +1,178 @@
+import pathlib
+import sqlite3
+import typing
+
+import pandas as pd
+
+import directories
+
+"""
+A persistent SQLite catalog of the detected microbursts with indexes
+on time and on L, MLT, and separation, so range and attribute queries
+don't need to scan every event. The database is in write-ahead log
+mode, so many batch detection processes can append while others
+query it.
+"""
+
+default_catalog_path = pathlib.Path(directories.merged_dir, 'barrel_microburst_catalog.db')
+
+# Catalog column name: (Detect.find_events column name, SQLite type)
+columns = {
+    'time':('time', 'TEXT NOT NULL'),
+    'pair':('pair', 'TEXT NOT NULL'),
+    'job_id':('job_id', 'TEXT'),
+    'start':('start', 'TEXT'),
+    'end':('end', 'TEXT'),
+    'dist_km':('dist_km', 'REAL'),
+    'L':('L', 'REAL'),
+    'MLT':('MLT', 'REAL'),
+    'peak_a':('_peak', 'REAL'),
+    'peak_b':('_peak', 'REAL'),
+    'n_std_a':('_n_std', 'REAL'),
+    'n_std_b':('_n_std', 'REAL'),
+    'corr':('corr', 'REAL'),
+    }
+time_format = '%Y-%m-%dT%H:%M:%S.%f'
+
+class EventCatalog:
+    def __init__(self, path:pathlib.Path=default_catalog_path, timeout_s:float=60,
+                wal:bool=True) -> None:
+        """
+        Open (and create if necessary) the event catalog. timeout_s is
+        how long a writer waits for another writer to finish. The write
+        ahead log needs shared memory between the processes, so set 
+        wal=False if the catalog is on a network filesystem.
+        """
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=timeout_s)
+        if wal:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+        self._create_tables()
+        return
+
+    def _create_tables(self) -> None:
+        column_defs = ', '.join(f'"{name}" {sql_type}'
+                                for name, (_, sql_type) in columns.items())
+        with self.conn:
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS events ({column_defs}, '
+                              'UNIQUE(pair, time))')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_time ON events (time)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_l_mlt ON events (L, MLT)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_dist ON events (dist_km)')
+        return
+
+    def append(self, events:pd.DataFrame, job_id:str=None, pair:str=None,
+                time_range:typing.Tuple[str, str]=None) -> int:
+        """
+        Append the events from Detect.find_events (with the pair
+        column added, see batch_detect.run_job) in one transaction.
+        An event that is already in the catalog (same pair and time) is
+        replaced. A rerun with changed data or config can find events
+        at other times, so the previous events of the rerun are deleted
+        in the same transaction: the events of job_id if it is given, 
+        and the events of pair in the inclusive time_range (or all of
+        them if time_range is None) if pair is given.
+        Returns the number of appended rows.
+        """
+        peak_columns = [c for c in events.columns if c.endswith('_peak')]
+        n_std_columns = [c for c in events.columns if c.endswith('_n_std')]
+        rows = pd.DataFrame({
+            name:self._event_column(events, source, peak_columns, n_std_columns, name)
+            for name, (source, _) in columns.items()
+            })
+        for name in ['time', 'start', 'end']:
+            rows[name] = pd.to_datetime(rows[name]).dt.strftime(time_format)
+        rows = rows.astype(object).where(rows.notna(), None)
+
+        placeholders = ', '.join('?'*len(columns))
+        column_names = ', '.join(f'"{name}"' for name in columns)
+        with self.conn:
+            if job_id is not None:
+                self.conn.execute('DELETE FROM events WHERE job_id = ?', (job_id,))
+            if pair is not None:
+                sql = 'DELETE FROM events WHERE pair = ?'
+                parameters = [pair.lower()]
+                if time_range is not None:
+                    sql += ' AND time >= ? AND time <= ?'
+                    parameters.extend(pd.Timestamp(t).strftime(time_format) for t in time_range)
+                self.conn.execute(sql, parameters)
+            self.conn.executemany(
+                f'INSERT OR REPLACE INTO events ({column_names}) VALUES ({placeholders})',
+                rows.itertuples(index=False, name=None))
+        return rows.shape[0]
+
+    def query(self, start:str=None, end:str=None, pair:str=None,
+            L_range:typing.Tuple[float, float]=None,
+            MLT_range:typing.Tuple[float, float]=None,
+            max_dist_km:float=None) -> pd.DataFrame:
+        """
+        Query the events in the [start, end) time range, with L and MLT
+        in the [min, max) ranges, and separation below max_dist_km.
+        An MLT_range with min > max wraps around midnight, e.g. (22, 2).
+        Every argument is optional.
+        """
+        conditions = []
+        parameters = []
+        if start is not None:
+            conditions.append('time >= ?')
+            parameters.append(pd.Timestamp(start).strftime(time_format))
+        if end is not None:
+            conditions.append('time < ?')
+            parameters.append(pd.Timestamp(end).strftime(time_format))
+        if pair is not None:
+            conditions.append('pair = ?')
+            parameters.append(pair.lower())
+        if L_range is not None:
+            conditions.append('L >= ? AND L < ?')
+            parameters.extend(L_range)
+        if MLT_range is not None:
+            if MLT_range[0] <= MLT_range[1]:
+                conditions.append('MLT >= ? AND MLT < ?')
+            else:
+                conditions.append('(MLT >= ? OR MLT < ?)')
+            parameters.extend(MLT_range)
+        if max_dist_km is not None:
+            conditions.append('dist_km < ?')
+            parameters.append(max_dist_km)
+
+        sql = 'SELECT * FROM events'
+        if len(conditions):
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY time'
+        return pd.read_sql_query(sql, self.conn, params=parameters,
+                                parse_dates={key:{'format':time_format}
+                                            for key in ['time', 'start', 'end']})
+
+    def close(self) -> None:
+        self.conn.close()
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+        return
+
+    @staticmethod
+    def _event_column(events, source, peak_columns, n_std_columns, name):
+        """
+        Map the Detect.find_events columns to the catalog columns. The
+        peak and n_std columns are named after the payloads' detect
+        channels, so they are mapped by position (a, then b).
+        """
+        if source in ['_peak', '_n_std']:
+            source_columns = peak_columns if source == '_peak' else n_std_columns
+            i = 0 if name.endswith('_a') else 1
+            if i < len(source_columns):
+                return events[source_columns[i]].to_numpy()
+        elif source in events.columns:
+            return events[source].to_numpy()
+        return [None]*events.shape[0]
+
+if __name__ == '__main__':
+    # Example: the close conjunction events on the dawn side.
+    with EventCatalog() as catalog:
+        events = catalog.query(max_dist_km=50, MLT_range=(0, 6))
+    print(events)
@@ -0,0 +1,186 @@
+import argparse
+import concurrent.futures
+import pathlib
+import typing
+
+import numpy as np
+import pandas as pd
+
+import directories
+import find_microbursts
+import rolling
+
+"""
+Monte Carlo estimate of how often chance alone satisfies both of the
+Detect criteria (baseline_std_thresh and correlation_thresh). The
+surrogates break the physical coincidence between the payloads by
+either circularly time-shifting the second payload's series, or by
+drawing Poisson noise around its rolling baseline. Each batch of
+surrogates is evaluated at once with the rolling.py kernels, and the
+batches are spread over a process pool.
+"""
+
+# The data that every worker process needs, set once by _init_worker
+# so the long arrays aren't pickled for every batch.
+_worker_data = {}
+
+def count_events(n_std_a:np.ndarray, n_std_b:np.ndarray, corr:np.ndarray,
+                std_thresholds:np.ndarray, corr_thresholds:np.ndarray) -> np.ndarray:
+    """
+    Count the events (runs of consecutive detections) for every
+    (baseline_std_thresh, correlation_thresh) pair. n_std_b and corr
+    can be a batch with shape (n_surrogates, n). Returns an array with
+    shape (n_surrogates, len(std_thresholds), len(corr_thresholds)).
+    """
+    # np.minimum propagates NaN, and NaN is never above a threshold.
+    min_n_std, corr = np.atleast_2d(np.minimum(n_std_a, n_std_b), corr)
+
+    counts = np.zeros((min_n_std.shape[0], len(std_thresholds), len(corr_thresholds)),
+                        dtype=int)
+    for i, std_thresh in enumerate(std_thresholds):
+        std_detected = min_n_std > std_thresh
+        for j, corr_thresh in enumerate(corr_thresholds):
+            detected = std_detected & (corr > corr_thresh)
+            # Count the rising edges, i.e. the start of every run.
+            counts[:, i, j] = detected[:, 0] + (detected[:, 1:] & ~detected[:, :-1]).sum(axis=1)
+    return counts
+
+def shift_surrogates(x:np.ndarray, shifts:np.ndarray) -> np.ndarray:
+    """
+    Circularly shift x by each of the shifts (in data points).
+    """
+    idx = (np.arange(x.shape[-1]) - np.asarray(shifts)[:, np.newaxis]) % x.shape[-1]
+    return x[idx]
+
+def poisson_surrogates(baseline:np.ndarray, n_surrogates:int,
+                        rng:np.random.Generator) -> np.ndarray:
+    """
+    Draw n_surrogates Poisson realizations around the baseline. The
+    points where the baseline is NaN stay NaN.
+    """
+    valid = np.isfinite(baseline)
+    surrogates = rng.poisson(np.where(valid, baseline, 0),
+                            size=(n_surrogates, baseline.shape[0])).astype(float)
+    surrogates[:, ~valid] = np.nan
+    return surrogates
+
+def _init_worker(data:typing.Dict) -> None:
+    _worker_data.update(data)
+    return
+
+def _run_batch(seed:np.random.SeedSequence, n_surrogates:int) -> np.ndarray:
+    """
+    Generate and evaluate one batch of surrogates in a worker process.
+    """
+    d = _worker_data
+    rng = np.random.default_rng(seed)
+    n = d['a'].shape[0]
+
+    if d['method'] == 'shift':
+        # Shift by at least one baseline window so the surrogate is
+        # uncorrelated with the real data. The shifted series keeps
+        # its own baseline significance.
+        shifts = rng.integers(d['baseline_window'], n - d['baseline_window'],
+                            size=n_surrogates)
+        b = shift_surrogates(d['b'], shifts)
+        n_std_b = shift_surrogates(d['n_std_b'], shifts)
+    elif d['method'] == 'poisson':
+        b = poisson_surrogates(d['baseline_b'], n_surrogates, rng)
+        n_std_b = rolling.baseline_significance(b, d['baseline_window'])
+    else:
+        raise ValueError(f'Unknown surrogate method {d["method"]}. '
+                        'Use "shift" or "poisson".')
+
+    corr = rolling.rolling_corr(d['a'], b, d['corr_window'])
+    return count_events(d['n_std_a'], n_std_b, corr,
+                        d['std_thresholds'], d['corr_thresholds'])
+
+def false_alarm_rates(a:np.ndarray, b:np.ndarray, baseline_window:int, corr_window:int,
+                    std_thresholds:typing.Iterable, corr_thresholds:typing.Iterable,
+                    cadence_s:float=50E-3, n_surrogates:int=1000, method:str='shift',
+                    batch_size:int=8, n_workers:int=None, seed:int=None) -> pd.DataFrame:
+    """
+    Estimate the false alarm rate for every (baseline_std_thresh,
+    correlation_thresh) pair from n_surrogates surrogates of b. a and
+    b are the detect channel counts on a fixed cadence_s grid with NaN
+    in the gaps. The surrogates are evaluated in batches of batch_size
+    (which sets the worker memory use: about 5*8*len(a)*batch_size
+    bytes) on n_workers processes.
+
+    Returns a DataFrame with the number of events in the real data, the
+    mean number of events in the surrogates, the false alarm rate per
+    hour of valid data, and the fraction of surrogates with at least
+    as many events as the real data.
+    """
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    std_thresholds = np.asarray(std_thresholds, dtype=float)
+    corr_thresholds = np.asarray(corr_thresholds, dtype=float)
+    n_std_a = rolling.baseline_significance(a, baseline_window)
+    n_std_b = rolling.baseline_significance(b, baseline_window)
+    observed = count_events(n_std_a, n_std_b, rolling.rolling_corr(a, b, corr_window),
+                            std_thresholds, corr_thresholds)[0]
+
+    data = {
+        'a':a, 'b':b, 'n_std_a':n_std_a, 'n_std_b':n_std_b,
+        'baseline_b':rolling.rolling_mean(b, baseline_window),
+        'baseline_window':baseline_window, 'corr_window':corr_window,
+        'std_thresholds':std_thresholds, 'corr_thresholds':corr_thresholds,
+        'method':method
+        }
+    batch_sizes = [batch_size]*(n_surrogates//batch_size)
+    if n_surrogates % batch_size:
+        batch_sizes.append(n_surrogates % batch_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+
+    surrogate_counts = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers,
+            initializer=_init_worker, initargs=(data,)) as executor:
+        for counts in executor.map(_run_batch, seeds, batch_sizes):
+            surrogate_counts.append(counts)
+    surrogate_counts = np.concatenate(surrogate_counts)
+
+    valid_hours = np.sum(np.isfinite(a) & np.isfinite(b))*cadence_s/3600
+    std_grid, corr_grid = np.meshgrid(std_thresholds, corr_thresholds, indexing='ij')
+    return pd.DataFrame({
+        'baseline_std_thresh':std_grid.ravel(),
+        'correlation_thresh':corr_grid.ravel(),
+        'observed_events':observed.ravel(),
+        'surrogate_mean_events':surrogate_counts.mean(axis=0).ravel(),
+        'false_alarm_rate_per_hour':surrogate_counts.mean(axis=0).ravel()/valid_hours,
+        'p_value':(surrogate_counts >= observed).mean(axis=0).ravel()
+        })
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Microburst false alarm rates.')
+    parser.add_argument('--pair', default='3g_3f')
+    parser.add_argument('--method', default='shift', choices=['shift', 'poisson'])
+    parser.add_argument('--n_surrogates', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    config = {
+        'baseline_width_min':5,
+        'correlation_width_s':1,
+        'detect_channel':'FSPC1a',
+        'time_range':['20150826T04:30:00', '20150826T08:25:00']
+        }
+    fs_path = pathlib.Path(directories.merged_dir, f'barrel_{args.pair}_merged_fast_spectra.csv')
+    ephem_path = pathlib.Path(directories.merged_dir, f'barrel_{args.pair}_merged_ephemeris.csv')
+    d = find_microbursts.Detect(fs_path, ephem_path, config)
+    d.load_merged_data()
+    detect_channels = [column for column in d.fs.columns
+                        if config['detect_channel'] in column]
+
+    rates = false_alarm_rates(
+        d.fs[detect_channels[0]].to_numpy(), d.fs[detect_channels[1]].to_numpy(),
+        d.baseline_window(),
+        d.correlation_window(),
+        std_thresholds=[1, 2, 3, 4, 5], corr_thresholds=[0.5, 0.6, 0.7, 0.8, 0.9],
+        cadence_s=d.fs_cadence_s, n_surrogates=args.n_surrogates, method=args.method,
+        n_workers=args.workers, seed=args.seed
+        )
+    save_path = pathlib.Path(directories.merged_dir, f'barrel_{args.pair}_false_alarm_rates_{args.method}.csv')
+    rates.to_csv(save_path, index=False)
+    print(rates)
@@ -1,23 +1,66 @@
+import concurrent.futures
+
 import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
 import pathlib
+import sys
 import typing
 
 import directories
-import mission_tools.misc.locate_consecutive_numbers as locate_consecutive_numbers
+import rolling
+
+# data_preprocessing, data_cache, merged_store, and provenance are in 
+# the top directory.
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+import data_cache
+import data_preprocessing
+import merged_store
+import provenance
 
-from pandas.plotting import register_matplotlib_converters
-register_matplotlib_converters()
+# matplotlib is imported in plot_detections so the batch detection 
+# workers, that never plot, don't pay for the import.
 
 path_type = typing.NewType('path_type', pathlib.Path)
 
+def locate_runs(mask:np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the start and end (inclusive) indices of every run of 
+    consecutive True values in the boolean mask.
+    """
+    edges = np.diff(np.concatenate(([0], np.asarray(mask, dtype=np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    return starts, ends
+
+def chunk_statistics(fs:pd.DataFrame, config:typing.Dict
+                    ) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculate the rolling correlation and n_std of one chunk of the 
+    fast spectra (the two detect channels and the gap column) in a
+    Detect.detect_chunked worker process.
+    """
+    d = Detect(None, None, config)
+    d.set_merged_data(fs, pd.DataFrame())
+    d.detect()
+    return d.corr.to_numpy(), d.n_std.to_numpy()
+
 class Detect:
     def __init__(self, fs_path:path_type, ephem_path:path_type, config:typing.Dict) -> None:
         """
         Detect microbursts using the number of standard deviations 
         above the baseline method assuming Poisson statistics and
-        correlate the fast spectra data between the two payloads
+        correlate the fast spectra data between the two payloads.
+
+        The optional config['engine'] selects how the rolling statistics
+        are calculated: 'pandas' (the default) with the pandas rolling 
+        methods, or 'numpy' and 'numba' with the rolling.py kernels (the
+        two channels and the correlation are then calculated in a 
+        thread pool).
+
+        Set config['n_workers'] > 1 to split the fast spectra into 
+        config['n_chunks'] (n_workers by default) time chunks that are
+        processed in parallel by detect_chunked. The chunks use the 
+        numpy engine unless config['engine'] is 'numba'.
         """
         self.config = config
         self.fs_cadence_s = 50E-3
@@ -28,10 +71,55 @@ class Detect:
     def load_merged_data(self) -> None:
         """
         Make sure to run data_preprocessing.py to generate the merged
-        ephemeris and fast spectra data that this method loads.
+        ephemeris and fast spectra data that this method loads. The
+        paths are either csv files or merged_store.py store directories,
+        and only the time_range segments of a store are read.
+        """
+        fs, ephem = (self._read_merged(path) for path in [self.fs_path, self.ephem_path])
+        self.set_merged_data(fs, ephem)
+        return
+
+    def _read_merged(self, path:path_type) -> pd.DataFrame:
+        if pathlib.Path(path).is_dir():
+            time_range = self.config.get('time_range') or [None, None]
+            df = merged_store.MergedStore(path).read(*time_range)
+            if 'gap' in df.columns:
+                # Put the segments on one grid so the day boundaries are gaps too.
+                df = data_preprocessing.resample_fixed_cadence(df, cadence_s=self.fs_cadence_s)
+            return df
+        return pd.read_csv(data_cache.cached_path(path), parse_dates=True, index_col=0)
+
+    def sources(self) -> typing.List[pathlib.Path]:
+        """
+        The merged files that the events are found from. A store is 
+        represented by its manifest, that changes on every append.
         """
-        self.fs = pd.read_csv(self.fs_path, parse_dates=True, index_col=0)
-        self.ephem = pd.read_csv(self.ephem_path, parse_dates=True, index_col=0)
+        return [pathlib.Path(path, merged_store.manifest_name) if pathlib.Path(path).is_dir()
+                else pathlib.Path(path) for path in [self.fs_path, self.ephem_path]]
+
+    def is_fresh(self, save_path:path_type) -> bool:
+        """
+        True if the events in save_path were found with this config from
+        the current merged files, so detect does not need to run again.
+        Only the file stats are compared (see provenance.is_fresh).
+        """
+        return provenance.is_fresh(save_path, self.sources(), self.config)
+
+    def save_events(self, events:pd.DataFrame, save_path:path_type) -> None:
+        """
+        Save the find_events events with a provenance sidecar for is_fresh.
+        """
+        events.to_csv(save_path, index=False)
+        provenance.write_metadata(save_path, events, self.sources(), self.config)
+        return
+
+    def set_merged_data(self, fs:pd.DataFrame, ephem:pd.DataFrame) -> None:
+        """
+        Use the already loaded merged fast spectra and ephemeris, e.g.
+        when other products are made from the same data in one process.
+        """
+        self.fs = fs
+        self.ephem = ephem
 
         # Filter the fast spectra and ephemeris if the time_range key is in config
         if self.config.get('time_range') is not None:
@@ -39,8 +127,50 @@ class Detect:
             end = self.config['time_range'][1]
             self.fs = self.fs.loc[start:end]
             self.ephem = self.ephem.loc[start:end]
+
+        # The rolling windows are a fixed number of points so the fast 
+        # spectra must be on the exact cadence grid. Older merged files 
+        # don't have the gap column and are resampled here.
+        if 'gap' not in self.fs.columns:
+            self.fs = data_preprocessing.resample_fixed_cadence(
+                self.fs, cadence_s=self.fs_cadence_s)
         return
 
+    def window_points(self, width_s:float) -> int:
+        """
+        The number of fast spectra points in a width_s second window.
+        """
+        return int(round(width_s/self.fs_cadence_s))
+
+    def correlation_window(self) -> int:
+        """
+        The number of points in the rolling correlation window. This is
+        the original definition that the published event lists used. 
+        The float floor division gives 19 points for a 1 s window.
+        """
+        return int(self.config['correlation_width_s']//self.fs_cadence_s)
+
+    def baseline_window(self) -> int:
+        """
+        The number of points in the rolling baseline window. This is 
+        the original definition that the published event lists used. 
+        It treats baseline_width_min as seconds (100 points, or 5 s, 
+        for the 5 minute default). Set the optional 
+        config['baseline_width_s'] to use a baseline of that many 
+        seconds instead, e.g. 300 for 5 minutes. It changes the events.
+        """
+        if self.config.get('baseline_width_s') is not None:
+            return self.window_points(self.config['baseline_width_s'])
+        return int(self.config['baseline_width_min']/self.fs_cadence_s)
+
+    def gap_windows(self, window:int) -> np.ndarray:
+        """
+        A boolean array that is True where the trailing window of 
+        length window contains at least one data gap.
+        """
+        gaps = self.fs['gap'].to_numpy().astype(float)
+        return pd.Series(gaps).rolling(window, min_periods=1).max().to_numpy() > 0
+
     def rolling_correlation(self) -> None:
         """
         Use df.rolling.corr to apply a rolling cross-correlation to the
@@ -52,13 +182,15 @@ class Detect:
             f'correlate not found.\n {self.config["detect_channel"]=}, '
             f'{self.fs.columns=}'
         )
-        window_data_points = int(self.config['correlation_width_s']//self.fs_cadence_s)
+        window_data_points = self.correlation_window()
 
         self.rolling_fs = self.fs[detect_channels[0]].rolling(
             window= window_data_points
             )
 
         self.corr = self.rolling_fs.corr(self.fs[detect_channels[1]])
+        # Skip the windows that contain a data gap.
+        self.corr[self.gap_windows(window_data_points)] = np.nan
         # Mark bad correlations with np.nan
         # self.corr[self.corr > 1] = np.nan
         # Now roll the self.corr to center the non-NaN values
@@ -76,27 +208,169 @@ class Detect:
             f'correlate not found.\n {self.config["detect_channel"]=}, '
             f'{self.fs.columns=}'
         )
-        baseline_window_points = int(self.config['baseline_width_min']/self.fs_cadence_s)
+        baseline_window_points = self.baseline_window()
         rolling_average_a = self.fs[detect_channels[0]].rolling(window=baseline_window_points).mean()
         rolling_average_b = self.fs[detect_channels[1]].rolling(window=baseline_window_points).mean()
         n_std_a = (self.fs[detect_channels[0]]-rolling_average_a)/np.sqrt(rolling_average_a+1)
         n_std_b = (self.fs[detect_channels[1]]-rolling_average_b)/np.sqrt(rolling_average_b+1)
         self.n_std = pd.DataFrame(np.array([n_std_a, n_std_b]).T, columns=detect_channels)
+        # Skip the windows that contain a data gap.
+        self.n_std.loc[self.gap_windows(baseline_window_points), :] = np.nan
         return
 
     def detect(self):
         """
-        Loads the data and runs the rolling_correlation and baseline_significance methods.
+        Loads the data (unless set_merged_data was called) and runs the 
+        rolling_correlation and baseline_significance methods.
         """
-        self.load_merged_data()
-        self.rolling_correlation()
-        self.baseline_significance()
+        if not hasattr(self, 'fs'):
+            self.load_merged_data()
+        if self.config.get('n_workers', 1) > 1:
+            self.detect_chunked(self.config['n_workers'], 
+                                self.config.get('n_chunks', self.config['n_workers']))
+            return
+        engine = self.config.get('engine', 'pandas')
+        if engine == 'pandas':
+            self.rolling_correlation()
+            self.baseline_significance()
+        else:
+            self.kernel_statistics(engine)
         return
 
+    def detect_chunked(self, n_workers:int, n_chunks:int) -> None:
+        """
+        Calculate corr and n_std in n_chunks time chunks with a process
+        pool. The windows are trailing, so every chunk is extended 
+        backwards by a halo of the largest window minus one point and 
+        the halo is dropped from the results. Then every kept point has
+        the same window as in a single process run, and the stitched 
+        results are exactly equal to a single process run. That needs 
+        the exact numpy or numba engine (numpy by default), since the
+        pandas engine rolling sums depend on the chunk start at the 
+        round-off level, so the pandas engine is not allowed.
+        """
+        engine = self.config.get('engine', 'numpy')
+        assert engine in ['numpy', 'numba'], (
+            f'The chunked detection needs the numpy or numba engine. Got {engine=}')
+        detect_channels = [column for column in self.fs.columns 
+                                if self.config['detect_channel'] in column ]
+        assert len(detect_channels) == 2, ('Two energy channels to '
+            f'correlate not found.\n {self.config["detect_channel"]=}, '
+            f'{self.fs.columns=}'
+        )
+        halo = max(self.correlation_window(), self.baseline_window()) - 1
+        # The workers run single process detect on their chunk.
+        chunk_config = {key:value for key, value in self.config.items() 
+                        if key not in ['time_range', 'n_workers', 'n_chunks']}
+        chunk_config['engine'] = engine
+        fs = self.fs[detect_channels + ['gap']]
+        bounds = np.linspace(0, fs.shape[0], n_chunks+1).astype(int)
+        starts = np.maximum(bounds[:-1] - halo, 0)
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(chunk_statistics, fs.iloc[start:end], chunk_config)
+                        for start, end in zip(starts, bounds[1:])]
+            results = [future.result() for future in futures]
+
+        keep = bounds[:-1] - starts
+        self.corr = pd.Series(np.concatenate([corr[k:] for (corr, _), k in zip(results, keep)]),
+                            index=self.fs.index)
+        self.n_std = pd.DataFrame(
+            np.concatenate([n_std[k:] for (_, n_std), k in zip(results, keep)]),
+            columns=detect_channels)
+        return
+
+    def kernel_statistics(self, engine:str) -> None:
+        """
+        Calculate the same corr and n_std as the rolling_correlation
+        and baseline_significance methods, with the rolling.py kernels.
+        The compiled Numba kernels release the GIL, so the channels 
+        run concurrently in the thread pool.
+        """
+        detect_channels = [column for column in self.fs.columns 
+                                if self.config['detect_channel'] in column ]
+        assert len(detect_channels) == 2, ('Two energy channels to '
+            f'correlate not found.\n {self.config["detect_channel"]=}, '
+            f'{self.fs.columns=}'
+        )
+        a, b = (self.fs[channel].to_numpy(dtype=float) for channel in detect_channels)
+        corr_window = self.correlation_window()
+        baseline_window = self.baseline_window()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            corr = executor.submit(rolling.rolling_corr, a, b, corr_window, engine)
+            n_std = [executor.submit(rolling.baseline_significance, x, baseline_window, engine)
+                    for x in (a, b)]
+            self.corr = pd.Series(corr.result(), index=self.fs.index)
+            self.n_std = pd.DataFrame(np.array([f.result() for f in n_std]).T, 
+                                    columns=detect_channels)
+        # Skip the windows that contain a data gap.
+        self.corr[self.gap_windows(corr_window)] = np.nan
+        self.n_std.loc[self.gap_windows(baseline_window), :] = np.nan
+        return
+
+    def find_events(self) -> pd.DataFrame:
+        """
+        Find the intervals where both payloads are baseline_std_thresh 
+        standard deviations above the baseline and the correlation is 
+        above correlation_thresh. Each interval is one event, timestamped
+        at the peak counts of the first payload, and annotated with the
+        nearest ephemeris values. Run the detect method first.
+        """
+        detect_channels = list(self.n_std.columns)
+        n_std = self.n_std.to_numpy()
+        counts = self.fs[detect_channels].to_numpy()
+        detected = (
+            np.all(n_std > self.config['baseline_std_thresh'], axis=1) & 
+            (self.corr.to_numpy() > self.config['correlation_thresh'])
+            )
+        starts, ends = locate_runs(detected)
+
+        # Find the peak of every event at once by sorting the samples 
+        # in each run by descending counts.
+        lengths = ends - starts + 1
+        offsets = np.cumsum(lengths) - lengths
+        run_id = np.repeat(np.arange(len(starts)), lengths)
+        idx = np.arange(lengths.sum()) + np.repeat(starts - offsets, lengths)
+        order = np.lexsort((-counts[idx, 0], run_id))
+        peak_idx = idx[order][offsets]
+
+        events = pd.DataFrame({
+            'time':self.fs.index[peak_idx],
+            'start':self.fs.index[starts],
+            'end':self.fs.index[ends],
+            f'{detect_channels[0]}_peak':counts[peak_idx, 0],
+            f'{detect_channels[1]}_peak':counts[peak_idx, 1],
+            f'{detect_channels[0]}_n_std':n_std[peak_idx, 0],
+            f'{detect_channels[1]}_n_std':n_std[peak_idx, 1],
+            'corr':self.corr.to_numpy()[peak_idx]
+            })
+
+        # Annotate the events with the separation, L, and MLT.
+        payload = detect_channels[0].split('_')[0]
+        ephem_columns = {
+            'dist_km':'dist_km', 
+            f'{payload}_L_Kp2':'L', 
+            f'{payload}_MLT_Kp2_T89c':'MLT'
+            }
+        ephem = self.ephem[
+            [column for column in ephem_columns if column in self.ephem.columns]
+            ].rename(columns=ephem_columns)
+        # merge_asof needs the same time resolution on both sides.
+        ephem.index = ephem.index.values.astype('datetime64[ns]')
+        events['time'] = events['time'].values.astype('datetime64[ns]')
+        events = pd.merge_asof(events, ephem, left_on='time', right_index=True,
+                                direction='nearest', tolerance=pd.Timedelta(minutes=1))
+        return events
+
     def plot_detections(self):
         """ 
         This method plots the microburst detections
         """
+        import matplotlib.pyplot as plt
+        from pandas.plotting import register_matplotlib_converters
+        register_matplotlib_converters()
+
         fig, ax = plt.subplots(3, 1, sharex=True)
         bx = (len(ax)-1)*[None]
         # Plot the Fast Spectra data
@@ -113,8 +387,8 @@ class Detect:
         bx[0] = ax[0].twinx()
         bx[1] = ax[1].twinx()
 
-        bx[0].plot(self.fs.index, self.n_std[d.n_std.columns[0]], c='b')
-        bx[1].plot(self.fs.index, self.n_std[d.n_std.columns[1]], c='b')
+        bx[0].plot(self.fs.index, self.n_std[self.n_std.columns[0]], c='b')
+        bx[1].plot(self.fs.index, self.n_std[self.n_std.columns[1]], c='b')
         
         ax[0].set(title='BARREL microburst detection validation', ylabel=detect_channels[0])
         ax[1].set(ylabel=detect_channels[1])
@@ -127,6 +401,8 @@ class Detect:
         return
 
 if __name__ == '__main__':
+    import matplotlib.pyplot as plt
+
     config = {
         'baseline_width_min':5,
         'baseline_std_thresh':2,
@@ -135,14 +411,8 @@ if __name__ == '__main__':
         'detect_channel':'FSPC1a',
         'time_range':['20150826T04:30:00', '20150826T08:25:00']
         }
-    fs_path = pathlib.Path(directories.top_dir, 
-        'merged_data', 
-        'barrel_3g_3f_merged_fast_spectra.csv'
-        )
-    ephem_path = pathlib.Path(directories.top_dir, 
-        'merged_data', 
-        'barrel_3g_3f_merged_ephemeris.csv'
-        )
+    fs_path = pathlib.Path(directories.merged_dir, 'barrel_3g_3f_merged_fast_spectra.csv')
+    ephem_path = pathlib.Path(directories.merged_dir, 'barrel_3g_3f_merged_ephemeris.csv')
     d = Detect(fs_path, ephem_path, config)
     d.detect()
     d.plot_detections()
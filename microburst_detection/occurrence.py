@@ -0,0 +1,215 @@
+import concurrent.futures
+import pathlib
+import sys
+import typing
+
+import numpy as np
+import pandas as pd
+
+import directories
+
+# merged_store is in the top directory.
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+import merged_store
+
+"""
+L x MLT x separation occurrence statistics. The observation time
+(dwell) is binned from the merged ephemeris and the detected events
+from the event catalog, and the occurrence rate is their ratio. The
+merged ephemeris is split into days (the segments of a merged_store.py
+store, or the rows of each day of a merged csv file) that are streamed
+in chunks into partial histograms in parallel and added together, so 
+many days, pairs, and campaigns can be combined without holding all of
+the data in memory.
+"""
+
+default_bins = {
+    'L':np.arange(2, 11),
+    'MLT':np.arange(0, 25),
+    'dist_km':np.array([0, 25, 50, 100, 200, 400, 1000])
+    }
+
+class OccurrenceMap:
+    def __init__(self, bins:typing.Dict[str, np.ndarray]=default_bins) -> None:
+        """
+        An empty occurrence map. bins is a dictionary of the bin edges
+        of the L, MLT, and dist_km axes, in that order.
+        """
+        self.bins = {key:np.asarray(edges, dtype=float) for key, edges in bins.items()}
+        self.shape = tuple(len(edges)-1 for edges in self.bins.values())
+        self.dwell_s = np.zeros(self.shape)
+        self.events = np.zeros(self.shape, dtype=int)
+        return
+
+    def histogram(self, sample:typing.List[np.ndarray],
+                weights:np.ndarray=None) -> np.ndarray:
+        """
+        Histogram the sample (one array per axis) with bincount. The
+        samples outside the bins (or NaN) are dropped, and the last bin
+        includes its right edge like np.histogramdd.
+        """
+        flat_idx = []
+        in_range = np.ones(sample[0].shape[0], dtype=bool)
+        for values, edges in zip(sample, self.bins.values()):
+            values = np.asarray(values, dtype=float)
+            idx = np.searchsorted(edges, values, side='right') - 1
+            idx[values == edges[-1]] = len(edges) - 2
+            in_range &= (idx >= 0) & (idx < len(edges) - 1)
+            flat_idx.append(idx)
+        flat_idx = np.ravel_multi_index([idx[in_range] for idx in flat_idx], self.shape)
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float)[in_range]
+        counts = np.bincount(flat_idx, weights=weights, minlength=np.prod(self.shape))
+        return counts.reshape(self.shape)
+
+    def add_dwell(self, ephem:pd.DataFrame, l_column:str, mlt_column:str,
+                dist_column:str='dist_km', previous_time:pd.Timestamp=None,
+                max_dt_s:float=60) -> None:
+        """
+        Add the observation time in ephem to the dwell histogram. Each
+        sample is weighted by the time since the previous sample, and
+        the time across gaps longer than max_dt_s is not counted. Pass
+        the last time of the previous chunk as previous_time so the
+        first sample of a chunk is weighted correctly.
+        """
+        t = ephem.index.values.astype('datetime64[ns]').view(np.int64)
+        if previous_time is None:
+            previous = t[0] if t.shape[0] else 0
+        else:
+            previous = np.datetime64(previous_time, 'ns').view(np.int64)
+        dt_s = np.diff(t, prepend=previous)/1E9
+        dt_s[(dt_s < 0) | (dt_s > max_dt_s)] = 0
+        self.dwell_s += self.histogram(
+            [ephem[l_column], ephem[mlt_column], ephem[dist_column]], weights=dt_s)
+        return
+
+    def add_events(self, events:pd.DataFrame) -> None:
+        """
+        Add the events (with the L, MLT, and dist_km columns, e.g. from
+        the event catalog) to the events histogram.
+        """
+        self.events += self.histogram(
+            [events['L'], events['MLT'], events['dist_km']]).astype(int)
+        return
+
+    def __iadd__(self, other:'OccurrenceMap') -> 'OccurrenceMap':
+        assert self.shape == other.shape, 'Can only add maps with the same bins.'
+        self.dwell_s += other.dwell_s
+        self.events += other.events
+        return self
+
+    def rate(self, axes:typing.Tuple[int, ...]=()) -> np.ndarray:
+        """
+        The occurrence rate in events/hour, optionally summed over the
+        axes first, e.g. axes=(2,) for the L x MLT map of all
+        separations. The bins without dwell time are NaN.
+        """
+        dwell_hours = self.dwell_s.sum(axis=axes)/3600
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(dwell_hours > 0, self.events.sum(axis=axes)/dwell_hours, np.nan)
+
+    def save(self, path:pathlib.Path) -> None:
+        np.savez(path, dwell_s=self.dwell_s, events=self.events,
+                **{f'bins_{key}':edges for key, edges in self.bins.items()})
+        return
+
+    @classmethod
+    def load(cls, path:pathlib.Path) -> 'OccurrenceMap':
+        data = np.load(path)
+        occurrence = cls({key[5:]:data[key] for key in data.files if key.startswith('bins_')})
+        occurrence.dwell_s = data['dwell_s']
+        occurrence.events = data['events']
+        return occurrence
+
+def day_units(path:pathlib.Path) -> typing.List[typing.Tuple[pathlib.Path, str, int, int]]:
+    """
+    Split a merged ephemeris source into the (path, day, first_row, 
+    n_rows) units of work of dwell_from_file: one per segment of a 
+    merged_store.py store directory, or one per run of rows of the
+    same UTC day in a merged csv file (only its time column is read to
+    find them).
+    """
+    path = pathlib.Path(path)
+    if path.is_dir():
+        return [(pathlib.Path(path, segment['file']), segment['date'], None, None)
+                for segment in merged_store.MergedStore(path).segments()]
+    times = pd.read_csv(path, usecols=[0], parse_dates=[0]).iloc[:, 0]
+    days = times.dt.strftime('%Y%m%d').to_numpy()
+    starts = np.flatnonzero(np.concatenate(([True], days[1:] != days[:-1])))
+    ends = np.append(starts[1:], days.shape[0])
+    return [(path, days[start], int(start), int(end-start)) for start, end in zip(starts, ends)]
+
+def dwell_from_file(path:pathlib.Path, l_column:str, mlt_column:str,
+                    bins:typing.Dict=default_bins, chunk_size:int=100_000,
+                    day:str=None, first_row:int=None, n_rows:int=None) -> OccurrenceMap:
+    """
+    Stream one merged ephemeris csv file (or its n_rows rows from 
+    first_row) in chunks into a dwell map, so only chunk_size rows are
+    in memory at a time. If day (YYYYMMDD) is given, only the rows on 
+    that UTC day are used, since the store segments overlap, and the 
+    first sample is weighted by the time since midnight. The time
+    between the last sample of the previous day and midnight is then
+    not counted.
+    """
+    occurrence = OccurrenceMap(bins)
+    previous_time = pd.Timestamp(day) if day is not None else None
+    for chunk in pd.read_csv(path, index_col=0, parse_dates=True,
+                            usecols=lambda c: c in ['Time', l_column, mlt_column, 'dist_km'],
+                            skiprows=range(1, first_row+1) if first_row else None,
+                            nrows=n_rows, chunksize=chunk_size):
+        if day is not None:
+            chunk = chunk[chunk.index.normalize() == pd.Timestamp(day)]
+        occurrence.add_dwell(chunk, l_column, mlt_column, previous_time=previous_time)
+        previous_time = chunk.index[-1] if chunk.shape[0] else previous_time
+    return occurrence
+
+def occurrence_map(ephem_sources:typing.List[typing.Tuple[pathlib.Path, str, str]],
+                events:pd.DataFrame=None, bins:typing.Dict=default_bins,
+                n_workers:int=None) -> OccurrenceMap:
+    """
+    Combine the dwell maps of the (path, l_column, mlt_column)
+    ephemeris sources, computed in parallel over their days (see 
+    day_units), and add the events. The path is a merged ephemeris csv
+    file or merged_store.py store directory.
+    """
+    occurrence = OccurrenceMap(bins)
+    units = [(*unit, l_column, mlt_column) for path, l_column, mlt_column in ephem_sources
+                for unit in day_units(path)]
+    if len(units):
+        paths, days, first_rows, n_rows, l_columns, mlt_columns = zip(*units)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+            for partial in executor.map(dwell_from_file, paths, l_columns, mlt_columns,
+                                        [bins]*len(units), [100_000]*len(units), days, 
+                                        first_rows, n_rows):
+                occurrence += partial
+    if events is not None:
+        occurrence.add_events(events)
+    return occurrence
+
+if __name__ == '__main__':
+    import matplotlib.pyplot as plt
+
+    pair = '3g_3f'
+    # Use the per-day store (run_pairs.py --append) if there is one.
+    ephem_path = pathlib.Path(directories.merged_dir, f'barrel_{pair}_merged_ephemeris')
+    if not ephem_path.is_dir():
+        ephem_path = ephem_path.with_name(f'{ephem_path.name}.csv')
+    ephem_sources = [(ephem_path, '3G_L_Kp2', '3G_MLT_Kp2_T89c')]
+    catalog_path = pathlib.Path(directories.merged_dir, 'barrel_microburst_catalog.csv')
+    events = pd.read_csv(catalog_path, parse_dates=['time'])
+    # The catalog has the events of all pairs, and the dwell is only 
+    # from this pair's ephemeris.
+    events = events[events['pair'] == pair]
+
+    occurrence = occurrence_map(ephem_sources, events)
+    occurrence.save(pathlib.Path(directories.merged_dir, 'barrel_microburst_occurrence.npz'))
+
+    fig, ax = plt.subplots(1, 2, figsize=(12, 5), sharey=True)
+    for a, values, label in zip(ax, [occurrence.dwell_s.sum(axis=2)/3600, occurrence.rate(axes=(2,))],
+                                ['Dwell [hours]', 'Occurrence rate [events/hour]']):
+        p = a.pcolormesh(occurrence.bins['MLT'], occurrence.bins['L'], values)
+        plt.colorbar(p, ax=a, label=label)
+        a.set(xlabel='MLT', title=label)
+    ax[0].set_ylabel('L')
+    plt.tight_layout()
+    plt.show()
@@ -0,0 +1,157 @@
+import importlib.util
+
+import numpy as np
+
+"""
+NumPy rolling window kernels. They work along the last axis so a batch
+of series (e.g. the false alarm surrogates) is evaluated in one call.
+The windows are trailing, and the output is NaN until the window is
+full or when the window contains a NaN, just like the pandas rolling
+methods with the default min_periods.
+
+The window sums are differences of cumulative sums, so they are exact
+for integer-valued counts (as long as the sums stay below 2^53).
+
+baseline_significance and rolling_corr optionally run as Numba
+compiled kernels (engine='numba') that make one pass over the data
+with running window sums, without the cumulative sum temporaries, and
+release the GIL so several channels can run in a thread pool. The
+running sums are also exact for integer-valued counts, so both engines
+give identical results for the fast spectra. engine='numba' falls back
+to NumPy if Numba is not installed. Numba is only imported, and the
+kernels compiled, on the first engine='numba' call, so the workers 
+that use the other engines don't pay for the import.
+"""
+
+# find_spec checks that Numba is installed without importing it.
+engines = ['numpy', 'numba'] if importlib.util.find_spec('numba') is not None else ['numpy']
+_compiled_kernels = {}
+
+def rolling_sum(x:np.ndarray, window:int) -> np.ndarray:
+    """
+    The trailing rolling sum of x along the last axis.
+    """
+    x = np.asarray(x, dtype=float)
+    valid = np.isfinite(x)
+    sums = _window_difference(np.cumsum(np.where(valid, x, 0), axis=-1), window)
+    n_invalid = _window_difference(np.cumsum(~valid, axis=-1), window)
+    sums[n_invalid != 0] = np.nan
+    return sums
+
+def rolling_mean(x:np.ndarray, window:int) -> np.ndarray:
+    """
+    The trailing rolling mean of x along the last axis.
+    """
+    return rolling_sum(x, window)/window
+
+def rolling_corr(x:np.ndarray, y:np.ndarray, window:int, engine:str='numpy') -> np.ndarray:
+    """
+    The trailing rolling Pearson correlation between x and y along the
+    last axis. x and y are broadcast against each other, so one series
+    can be correlated with a batch of series.
+    """
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    if _use_numba(engine):
+        return _apply_numba(_corr_kernel, window, x, y)
+    Sx = rolling_sum(x + 0*y, window)
+    Sy = rolling_sum(y + 0*x, window)
+    Sxx = rolling_sum(x*x + 0*y, window)
+    Syy = rolling_sum(y*y + 0*x, window)
+    Sxy = rolling_sum(x*y, window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        numerator = window*Sxy - Sx*Sy
+        denominator = np.sqrt((window*Sxx - Sx**2)*(window*Syy - Sy**2))
+        return numerator/denominator
+
+def baseline_significance(x:np.ndarray, window:int, engine:str='numpy') -> np.ndarray:
+    """
+    The number of standard deviations, assuming Poisson statistics,
+    that x is above its trailing rolling mean baseline.
+    """
+    if _use_numba(engine):
+        return _apply_numba(_significance_kernel, window, x)
+    baseline = rolling_mean(x, window)
+    return (np.asarray(x, dtype=float) - baseline)/np.sqrt(baseline + 1)
+
+def _window_difference(cumulative:np.ndarray, window:int) -> np.ndarray:
+    """
+    Turn a cumulative sum into trailing window sums, with NaN for the
+    first window-1 points that don't have a full window.
+    """
+    cumulative = cumulative.astype(float)
+    sums = np.full(cumulative.shape, np.nan)
+    if window <= cumulative.shape[-1]:
+        sums[..., window-1] = cumulative[..., window-1]
+        sums[..., window:] = cumulative[..., window:] - cumulative[..., :-window]
+    return sums
+
+def _use_numba(engine:str) -> bool:
+    assert engine in ['numpy', 'numba'], f'Unknown rolling engine {engine=}'
+    return (engine == 'numba') and ('numba' in engines)
+
+def _apply_numba(kernel, window:int, *arrays:np.ndarray) -> np.ndarray:
+    """
+    Run the compiled kernel on every series of the (broadcast) arrays,
+    flattened to 2D so the kernel only handles the (series, time) case.
+    """
+    if kernel not in _compiled_kernels:
+        import numba
+        # error_model='numpy' makes division by zero inf or NaN, like NumPy.
+        _compiled_kernels[kernel] = numba.njit(nogil=True, cache=True, 
+                                                error_model='numpy')(kernel)
+    shape = arrays[0].shape
+    arrays = [np.ascontiguousarray(a, dtype=float).reshape(-1, shape[-1]) for a in arrays]
+    out = np.empty(arrays[0].shape)
+    _compiled_kernels[kernel](*arrays, window, out)
+    return out.reshape(shape)
+
+def _significance_kernel(x, window, out):
+    for i in range(x.shape[0]):
+        s = 0.0
+        n_invalid = 0
+        for j in range(x.shape[1]):
+            if np.isfinite(x[i, j]):
+                s += x[i, j]
+            else:
+                n_invalid += 1
+            if j >= window:
+                if np.isfinite(x[i, j-window]):
+                    s -= x[i, j-window]
+                else:
+                    n_invalid -= 1
+            if (j < window-1) or (n_invalid > 0):
+                out[i, j] = np.nan
+            else:
+                baseline = s/window
+                out[i, j] = (x[i, j] - baseline)/np.sqrt(baseline + 1)
+    return
+
+def _corr_kernel(x, y, window, out):
+    for i in range(x.shape[0]):
+        sx = sy = sxx = syy = sxy = 0.0
+        n_invalid = 0
+        for j in range(x.shape[1]):
+            if np.isfinite(x[i, j]) and np.isfinite(y[i, j]):
+                sx += x[i, j]
+                sy += y[i, j]
+                sxx += x[i, j]*x[i, j]
+                syy += y[i, j]*y[i, j]
+                sxy += x[i, j]*y[i, j]
+            else:
+                n_invalid += 1
+            if j >= window:
+                k = j - window
+                if np.isfinite(x[i, k]) and np.isfinite(y[i, k]):
+                    sx -= x[i, k]
+                    sy -= y[i, k]
+                    sxx -= x[i, k]*x[i, k]
+                    syy -= y[i, k]*y[i, k]
+                    sxy -= x[i, k]*y[i, k]
+                else:
+                    n_invalid -= 1
+            if (j < window-1) or (n_invalid > 0):
+                out[i, j] = np.nan
+            else:
+                out[i, j] = (window*sxy - sx*sy)/np.sqrt(
+                    (window*sxx - sx*sx)*(window*syy - sy*sy))
+    return
@@ -0,0 +1,163 @@
+import pathlib
+import sys
+import typing
+
+import numpy as np
+import pandas as pd
+
+import directories
+
+# data_preprocessing is in the top directory.
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+import data_preprocessing
+
+"""
+Fits the exponential, J0*exp(-E/E0), and power law, J0*E^-gamma,
+energy spectra to the FSPC channels of every detected microburst at
+once. Both models are linear in log space, so all events are fit with
+one closed-form weighted least squares solve instead of a per-event
+scipy.optimize loop. The weights are the counts, since the variance
+of ln(counts) is 1/counts for Poisson statistics. The channel energy
+edges depend on each payload's gain, so they are the edges that 
+data_preprocessing.load_barrel_spectra read from the cdf files at 
+every event.
+"""
+
+def weighted_line_fit(x:np.ndarray, y:np.ndarray, w:np.ndarray
+                    ) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Closed-form weighted least squares fit of y = a + b*x along the
+    last axis, so every row of y is a separate fit. Points with w=0
+    are excluded. Returns a, b, and the reduced chi squared. Rows with
+    less than 2 valid points are NaN.
+    """
+    S = w.sum(axis=-1)
+    Sx = (w*x).sum(axis=-1)
+    Sy = (w*y).sum(axis=-1)
+    Sxx = (w*x*x).sum(axis=-1)
+    Sxy = (w*x*y).sum(axis=-1)
+    n_points = (w > 0).sum(axis=-1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        det = S*Sxx - Sx**2
+        b = (S*Sxy - Sx*Sy)/det
+        a = (Sxx*Sy - Sx*Sxy)/det
+        residuals = y - (a[..., np.newaxis] + b[..., np.newaxis]*x)
+        chi2 = (w*residuals**2).sum(axis=-1)/(n_points-2)
+    a[n_points < 2] = np.nan
+    b[n_points < 2] = np.nan
+    chi2[n_points < 3] = np.nan
+    return a, b, chi2
+
+def fit_spectra(counts:np.ndarray, channel_edges:np.ndarray,
+                background:np.ndarray=None, n_iterations:int=3) -> pd.DataFrame:
+    """
+    Fit the exponential and power law spectra to the counts array
+    with shape (events, channels). channel_edges are the lower and 
+    upper channel edges in keV, with shape (events, channels, 2), or
+    (channels, 2) if all events have the same edges. The background 
+    array, with the counts shape, is subtracted first if it is given.
+    Channels with no
+    (background-subtracted) counts are excluded from the fit. The
+    models are first fit at the channel centers (arithmetic for the
+    exponential and geometric for the power law) and then refit 
+    n_iterations times with the channel-average correction.
+
+    Returns a DataFrame with one row per event and the fit parameters
+    J0 in counts/keV, E0 in keV, gamma, and the reduced chi squared.
+    """
+    counts = np.atleast_2d(np.asarray(counts, dtype=float))
+    if background is not None:
+        counts = counts - np.atleast_2d(np.asarray(background, dtype=float))
+    edges = np.asarray(channel_edges, dtype=float)
+    width = edges[..., 1] - edges[..., 0]
+    center = edges.mean(axis=-1)
+    geometric_center = np.sqrt(edges[..., 0]*edges[..., 1])
+
+    valid = np.isfinite(counts) & (counts > 0)
+    w = np.where(valid, counts, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y = np.where(valid, np.log(counts/width), 0)
+
+    # The counts are integrated over wide channels, so the channel 
+    # average differs from the model at the channel center. That ratio
+    # only depends on the fit slope, so a few vectorized refits with 
+    # the ratio removed from y converge on the bin-integrated fit.
+    exp_a, exp_b, exp_chi2 = weighted_line_fit(center, y, w)
+    pl_a, pl_b, pl_chi2 = weighted_line_fit(np.log(geometric_center), y, w)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for _ in range(n_iterations):
+            half_width = -exp_b[:, np.newaxis]*width/2
+            exp_ratio = np.log(np.sinh(half_width)/half_width)
+            exp_a, exp_b, exp_chi2 = weighted_line_fit(
+                center, y - np.nan_to_num(exp_ratio), w)
+
+            g = -pl_b[:, np.newaxis]
+            bin_average = np.where(
+                np.abs(1-g) > 1E-6,
+                (edges[..., 1]**(1-g) - edges[..., 0]**(1-g))/((1-g)*width),
+                np.log(edges[..., 1]/edges[..., 0])/width
+                )
+            pl_ratio = np.log(bin_average*geometric_center**g)
+            pl_a, pl_b, pl_chi2 = weighted_line_fit(
+                np.log(geometric_center), y - np.nan_to_num(pl_ratio), w)
+
+    with np.errstate(divide='ignore'):
+        return pd.DataFrame({
+            'exp_J0':np.exp(exp_a),
+            'exp_E0_keV':-1/exp_b,
+            'exp_chi2':exp_chi2,
+            'pl_J0':np.exp(pl_a),
+            'pl_gamma':-pl_b,
+            'pl_chi2':pl_chi2,
+            'n_channels':valid.sum(axis=1)
+            })
+
+def event_spectra(fs:pd.DataFrame, times:typing.Iterable, payload:str,
+                baseline_width_s:float=None, cadence_s:float=50E-3
+                ) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray, typing.List[str]]:
+    """
+    Gather the FSPC counts and channel edges (events, channels, 2) of
+    the payload at all event times in one indexing operation. If 
+    baseline_width_s is given, the trailing rolling mean of each 
+    channel at the event times is returned as the background, 
+    otherwise the background is None. The fs index must be on the 
+    cadence_s grid (see data_preprocessing.resample_fixed_cadence), 
+    and fs must have the payload's edge_<i>_keV columns.
+    """
+    channels = [column for column in fs.columns
+                if column.startswith(f'{payload}_FSPC')]
+    idx = fs.index.get_indexer(pd.to_datetime(times), method='nearest')
+    counts = fs[channels].to_numpy()[idx]
+
+    edge_idx = [data_preprocessing.fspc_channels.index(channel[len(payload)+1:]) 
+                for channel in channels]
+    edges = fs[[f'{payload}_edge_{i}_keV' for i in range(len(data_preprocessing.fspc_channels)+1)]
+                ].to_numpy()[idx]
+    edges = np.stack((edges[:, edge_idx], edges[:, np.add(edge_idx, 1)]), axis=-1)
+
+    background = None
+    if baseline_width_s is not None:
+        window = int(round(baseline_width_s/cadence_s))
+        background = fs[channels].rolling(window).mean().to_numpy()[idx]
+    return counts, background, edges, channels
+
+if __name__ == '__main__':
+    # Fit the spectra of every event in the batch_detect.py catalog.
+    catalog_path = pathlib.Path(directories.merged_dir, 'barrel_microburst_catalog.csv')
+    fs_path = pathlib.Path(directories.merged_dir, 'barrel_3g_3f_merged_fast_spectra.csv')
+    save_path = pathlib.Path(directories.merged_dir, 'barrel_3g_3f_microburst_spectra.csv')
+
+    catalog = pd.read_csv(catalog_path, parse_dates=['time'])
+    catalog = catalog[catalog['pair'] == '3g_3f'].reset_index(drop=True)
+    fs = pd.read_csv(fs_path, parse_dates=True, index_col=0)
+
+    fits = []
+    for payload in ['3G', '3F']:
+        counts, background, edges, channels = event_spectra(fs, catalog['time'], payload,
+                                                            baseline_width_s=5*60)
+        fit = fit_spectra(counts, edges, background=background)
+        fits.append(fit.add_prefix(f'{payload}_'))
+    spectra = pd.concat([catalog[['pair', 'time']]] + fits, axis=1)
+    spectra.to_csv(save_path, index=False)
+    print(spectra.describe())
@@ -0,0 +1,185 @@
+import datetime
+import hashlib
+import json
+import os
+import pathlib
+import re
+import typing
+
+import pandas as pd
+
+"""
+Self-describing merged outputs. Every merged csv file gets a
+<name>.meta.json sidecar with its schema, the fingerprints (path, size,
+modification time, and cdf version) of the source files, the merge
+parameters, and a checksum of every column. is_fresh compares the
+sidecar with the current source files and parameters using only file
+stats, so a script can skip the recomputation when nothing upstream
+changed, and content_key gives the downstream caches (e.g. the batch
+detection checkpoints) a key that changes when the merged data does.
+
+The products made from the merged files (the plots and the event lists)
+get the same sidecar with the merged files as their sources, so they
+are skipped the same way.
+"""
+
+version_pattern = re.compile(r'_v(\d+)\.cdf$')
+
+def metadata_path(path:pathlib.Path) -> pathlib.Path:
+    path = pathlib.Path(path)
+    return path.with_name(f'{path.name}.meta.json')
+
+def fingerprint(path:pathlib.Path) -> typing.Dict:
+    """
+    The file's path, size, modification time, and (for the cdf files)
+    version.
+    """
+    path = pathlib.Path(path)
+    stat = path.stat()
+    version = version_pattern.search(path.name)
+    return {
+        'path':str(path.resolve()),
+        'size':stat.st_size,
+        'mtime_ns':stat.st_mtime_ns,
+        'version':int(version.group(1)) if version is not None else None
+        }
+
+def schema(df:pd.DataFrame) -> typing.Dict:
+    return {
+        'index':{'name':df.index.name, 'dtype':str(df.index.dtype)},
+        'columns':{column:str(dtype) for column, dtype in df.dtypes.items()}
+        }
+
+def column_checksums(df:pd.DataFrame) -> typing.Dict[str, str]:
+    """
+    The sha1 checksum of the index and every column's values.
+    """
+    checksums = {'index':_checksum(df.index.to_series())}
+    for column in df.columns:
+        checksums[column] = _checksum(df[column])
+    return checksums
+
+def write_metadata(path:pathlib.Path, df:typing.Optional[pd.DataFrame],
+                    sources:typing.List[pathlib.Path], params:typing.Dict) -> typing.Dict:
+    """
+    Write the sidecar of the merged output file in path, that was just
+    written from df. df is None for the outputs that are not tables,
+    e.g. the plots, and then the sidecar has no schema or checksums.
+    params must be json serializable.
+    """
+    metadata = {
+        'created':datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'n_rows':df.shape[0] if df is not None else None,
+        'schema':schema(df) if df is not None else None,
+        'params':params,
+        'sources':[fingerprint(source) for source in sorted(map(str, sources))],
+        'checksums':column_checksums(df) if df is not None else {},
+        'output':fingerprint(path)
+        }
+    tmp_path = metadata_path(path).with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(tmp_path, metadata_path(path))
+    return metadata
+
+def read_metadata(path:pathlib.Path) -> typing.Optional[typing.Dict]:
+    """
+    The sidecar of path, or None if it does not have one.
+    """
+    try:
+        with open(metadata_path(path)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def is_fresh(path:pathlib.Path, sources:typing.List[pathlib.Path],
+            params:typing.Dict) -> bool:
+    """
+    True if the output file in path was made from the same (unchanged)
+    source files with the same params, and was not modified since.
+    Only the file stats are compared, not the data.
+    """
+    metadata = read_metadata(path)
+    if metadata is None:
+        return False
+    return matches(metadata, path, sources, params)
+
+def matches(metadata:typing.Dict, path:pathlib.Path, sources:typing.List[pathlib.Path],
+            params:typing.Dict) -> bool:
+    """
+    The is_fresh check of the output file in path against its already
+    read metadata, e.g. a merged_store.py manifest entry.
+    """
+    try:
+        sources = [fingerprint(source) for source in sorted(map(str, sources))]
+        output = fingerprint(path)
+    except FileNotFoundError:
+        return False
+    return (
+        (metadata.get('params') == json.loads(json.dumps(params))) and
+        (metadata.get('sources') == sources) and
+        (metadata.get('output') == output)
+        )
+
+def verify(path:pathlib.Path, df:pd.DataFrame=None) -> typing.List[str]:
+    """
+    Return the columns whose checksums don't match the sidecar, after
+    reading the csv file in path (or the already read df). Unlike
+    is_fresh this reads all of the data.
+    """
+    metadata = read_metadata(path)
+    assert metadata is not None, f'{path} does not have a {metadata_path(path).name} file.'
+    return verify_metadata(metadata, path, df)
+
+def verify_metadata(metadata:typing.Dict, path:pathlib.Path, 
+                    df:pd.DataFrame=None) -> typing.List[str]:
+    """
+    The verify check of the csv file in path against its already read
+    metadata, e.g. a merged_store.py manifest entry.
+    """
+    assert metadata.get('schema') is not None, f'The {path} metadata does not have checksums.'
+    if df is None:
+        # round_trip parses the floats back to the exact written values.
+        df = pd.read_csv(path, index_col=0, parse_dates=True, float_precision='round_trip')
+        # The csv file does not keep the numeric dtype widths, e.g. the
+        # float32 cdf variables are read back as float64, so they are
+        # cast back to the recorded widths first.
+        for column, dtype in metadata['schema']['columns'].items():
+            if (column in df.columns and pd.api.types.is_numeric_dtype(df[column]) and
+                    not pd.api.types.is_bool_dtype(df[column])):
+                try:
+                    df[column] = df[column].astype(dtype)
+                except (TypeError, ValueError):
+                    # e.g. an integer column that was read back with NaN.
+                    pass
+    checksums = column_checksums(df)
+    return [column for column, checksum in metadata['checksums'].items()
+            if checksums.get(column) != checksum]
+
+def content_key(path:pathlib.Path) -> str:
+    """
+    A short key that changes when the merged data in path changes. It
+    is the hash of the sidecar's checksums and params if there is one,
+    and of the file's fingerprint otherwise.
+    """
+    metadata = read_metadata(path)
+    if metadata is not None:
+        key = {'checksums':metadata['checksums'], 'params':metadata['params']}
+    else:
+        key = fingerprint(path)
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:12]
+
+def _checksum(series:pd.Series) -> str:
+    # Hash the values the same way regardless of the dtype resolution
+    # that the csv reader picked for the time stamps, and of the
+    # numeric dtype width since hash_pandas_object depends on it.
+    if pd.api.types.is_datetime64_any_dtype(series):
+        series = series.astype('datetime64[ns]')
+    elif pd.api.types.is_bool_dtype(series):
+        pass
+    elif pd.api.types.is_float_dtype(series):
+        series = series.astype('float64')
+    elif pd.api.types.is_integer_dtype(series):
+        series = series.astype('int64')
+    hashes = pd.util.hash_pandas_object(series, index=False).to_numpy()
+    return hashlib.sha1(hashes.tobytes()).hexdigest()
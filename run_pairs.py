@@ -0,0 +1,333 @@
+# Makes the merged data, trajectory plot, fast spectra summary plot, and
+# microburst detections for every payload pair in flights.yaml. The data
+# is loaded once per pair and shared by all of its products, and the
+# pairs are processed in parallel.
+#
+# Usage: python3 run_pairs.py [--pairs 4g_4f 4g_4h] [--products preprocess trajectory]
+#
+# With --append, the merged data is kept in per-day merged_store.py 
+# stores instead of csv files, and only the flight dates that are not 
+# in the stores yet are merged and appended.
+
+import argparse
+import concurrent.futures
+import functools
+import pathlib
+import sys
+import typing
+
+import pandas as pd
+import yaml
+
+import directories
+import data_preprocessing
+import file_catalog
+import merged_store
+import provenance
+
+# The detection code lives in microburst_detection/.
+sys.path.append(str(pathlib.Path(__file__).resolve().parent / 'microburst_detection'))
+
+all_products = ['preprocess', 'trajectory', 'fast_spectra', 'detect']
+# The cdf quality flag variable. The records with a nonzero flag are
+# dropped. A pair can override it with its quality_variable key.
+default_quality_variable = 'Q'
+
+def load_config(path:pathlib.Path=pathlib.Path(directories.top_dir, 'flights.yaml')) -> typing.Dict:
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+def merged_paths(pair:str) -> typing.Tuple[pathlib.Path, pathlib.Path]:
+    """
+    The merged ephemeris and fast spectra csv file paths of a pair.
+    """
+    return (pathlib.Path(directories.merged_dir, f'barrel_{pair}_merged_ephemeris.csv'),
+            pathlib.Path(directories.merged_dir, f'barrel_{pair}_merged_fast_spectra.csv'))
+
+def store_paths(pair:str) -> typing.Tuple[pathlib.Path, pathlib.Path]:
+    """
+    The merged ephemeris and fast spectra store directories of a pair.
+    """
+    return (pathlib.Path(directories.merged_dir, f'barrel_{pair}_merged_ephemeris'),
+            pathlib.Path(directories.merged_dir, f'barrel_{pair}_merged_fast_spectra'))
+
+def merge_days(pair_config:typing.Dict, cdf_index:pd.DataFrame, dates:typing.List[str]
+                ) -> typing.Tuple[typing.Dict[str, pd.DataFrame], typing.Dict[str, pd.DataFrame]]:
+    """
+    Merge the pair's ephemeris (with the separation) and fast spectra 
+    on each of the dates. Returns dictionaries with date keys.
+    """
+    a, b = pair_config['payloads']
+    selection = {'dates':dates, 'payloads':[a, b], 'campaign':pair_config['campaign']}
+    quality_variable = pair_config.get('quality_variable', default_quality_variable)
+
+    ephem = file_catalog.load_by_date(
+        file_catalog.select(cdf_index, 'ephm', **selection),
+        functools.partial(data_preprocessing.load_barrel_ephem, 
+                        quality_variable=quality_variable))
+    ephem_merged = {}
+    for date in ephem:
+        ephem_merged[date] = data_preprocessing.merge_ballon_data(ephem[date])
+        ephem_merged[date]['dist_km'] = data_preprocessing.haversine(
+            ephem_merged[date][[f'{a}_GPS_Lat', f'{a}_GPS_Lon', f'{a}_GPS_Alt']],
+            ephem_merged[date][[f'{b}_GPS_Lat', f'{b}_GPS_Lon', f'{b}_GPS_Alt']]
+            )
+
+    fs = file_catalog.load_by_date(
+        file_catalog.select(cdf_index, 'fspc', **selection),
+        functools.partial(data_preprocessing.load_barrel_spectra, 
+                        quality_variable=quality_variable))
+    fs_merged = {date:data_preprocessing.merge_ballon_grid(fs[date]) for date in fs}
+    return ephem_merged, fs_merged
+
+def preprocess_sources(pair_config:typing.Dict, cdf_index:pd.DataFrame
+                        ) -> typing.Tuple[typing.List[str], typing.Dict]:
+    """
+    The cdf files and the merge parameters that the pair's merged data
+    is made from, for the provenance.py freshness check.
+    """
+    selection = {'dates':pair_config['flight_dates'], 'payloads':pair_config['payloads'],
+                'campaign':pair_config['campaign']}
+    sources = [path for product in ['ephm', 'fspc']
+                for path in file_catalog.select(cdf_index, product, **selection)['path']]
+    params = {**selection, 'ephem_tolerance_min':5, 'fs_merge':'grid', 
+            'fs_edges_variable':'FSPC_Edges', 'cadence_s':50E-3,
+            'quality_variable':pair_config.get('quality_variable', default_quality_variable)}
+    return sources, params
+
+def preprocess(pair_config:typing.Dict, cdf_index:pd.DataFrame
+                ) -> typing.Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Merge the pair's ephemeris and fast spectra over all flight dates.
+    """
+    ephem, fs = merge_days(pair_config, cdf_index, pair_config['flight_dates'])
+    ephem_merged = data_preprocessing.merge_ballon_times(ephem)
+    fs_merged = data_preprocessing.resample_fixed_cadence(
+        data_preprocessing.merge_ballon_times(fs))
+    return ephem_merged, fs_merged
+
+def preprocess_append(pair:str, pair_config:typing.Dict, cdf_index:pd.DataFrame) -> None:
+    """
+    Merge only the flight dates that are not in the pair's stores yet,
+    or whose cdf files or merge parameters changed since they were 
+    appended, and (re)append them, one segment per date.
+    """
+    ephem_store, fs_store = (merged_store.MergedStore(path) for path in store_paths(pair))
+    date_sources = {date:preprocess_sources({**pair_config, 'flight_dates':[date]}, cdf_index)
+                    for date in pair_config['flight_dates']}
+    stale_dates = [date for date, (sources, params) in date_sources.items()
+                    if not (ephem_store.is_fresh(date, sources, params) and 
+                            fs_store.is_fresh(date, sources, params))]
+    if len(stale_dates) == 0:
+        return
+    ephem, fs = merge_days(pair_config, cdf_index, stale_dates)
+    for date in ephem:
+        ephem_store.append(date, ephem[date], *date_sources[date])
+    for date in fs:
+        fs_store.append(date, data_preprocessing.resample_fixed_cadence(fs[date]), 
+                        *date_sources[date])
+    return
+
+def read_stores(pair:str) -> typing.Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Read the pair's merged ephemeris and fast spectra stores. The fast
+    spectra is put back on one grid so the day boundaries are gaps too.
+    """
+    ephem_path, fs_path = store_paths(pair)
+    ephem = merged_store.MergedStore(ephem_path).read()
+    fs = data_preprocessing.resample_fixed_cadence(merged_store.MergedStore(fs_path).read())
+    return ephem, fs
+
+def plot_trajectory(ephem:pd.DataFrame, payloads:typing.List[str],
+                    save_path:pathlib.Path, n_plot:int=100) -> None:
+    """
+    Plot the payload trajectories, altitudes, and separation.
+    """
+    import matplotlib.pyplot as plt
+    import matplotlib.dates
+
+    a, b = payloads
+    ephem_downsampled = ephem.iloc[::max(ephem.shape[0]//n_plot, 1)]
+
+    sm = plt.cm.ScalarMappable(cmap='viridis',
+                            norm=plt.Normalize(vmin=ephem.index.min().value,
+                                                vmax=ephem.index.max().value))
+    fig, ax = plt.subplots(1, 3, figsize=(15, 5))
+    ax[0].scatter(ephem_downsampled[f'{a}_GPS_Lon'], ephem_downsampled[f'{a}_GPS_Lat'],
+                c=ephem_downsampled.index, marker='o', s=50, alpha=0.5, label=a)
+    ax[0].scatter(ephem_downsampled[f'{b}_GPS_Lon'], ephem_downsampled[f'{b}_GPS_Lat'],
+                c=ephem_downsampled.index, marker='X', s=50, alpha=0.5, label=b)
+    cbar = plt.colorbar(sm, ax=ax[0], label='Time [MM/DD HH]')
+    # Change the numeric ticks into ones that match the x-axis
+    cbar.ax.set_yticklabels(pd.to_datetime(cbar.get_ticks()).strftime(date_format='%m/%d %H'))
+
+    ax[1].plot(ephem_downsampled.index, ephem_downsampled[f'{a}_GPS_Alt'], label=a)
+    ax[1].plot(ephem_downsampled.index, ephem_downsampled[f'{b}_GPS_Alt'], label=b)
+    ax[2].plot(ephem_downsampled.index, ephem_downsampled['dist_km'])
+
+    ax[0].set(title=f'BARREL {a} and {b} trajectories', xlabel='Lon', ylabel='Lat')
+    ax[1].set(title=f'BARREL {a} and {b} Altitude', ylabel='Altitude [km]',
+            xlabel='UTC', ylim=(20, None))
+    ax[2].set(title=f'BARREL {a} and {b} Separation', ylabel='Separation [km]',
+            xlabel='UTC')
+
+    time_fmt = matplotlib.dates.DateFormatter('%m/%d %H')
+    for axis in ax[1:]:
+        axis.xaxis.set_major_formatter(time_fmt)
+        axis.xaxis.set_minor_locator(matplotlib.dates.HourLocator(interval=1))
+        axis.xaxis.set_major_locator(matplotlib.dates.HourLocator(interval=6))
+    ax[0].legend()
+    ax[1].legend()
+    plt.tight_layout()
+    plt.savefig(save_path)
+    plt.close(fig)
+    return
+
+def plot_fast_spectra(fs:pd.DataFrame, payloads:typing.List[str],
+                    time_range:typing.List[str], save_path:pathlib.Path,
+                    max_points:int=100_000) -> None:
+    """
+    Plot the zoomed out fast spectra summary plot, one payload per panel.
+    """
+    import matplotlib.pyplot as plt
+
+    if time_range is not None:
+        fs = fs.loc[time_range[0]:time_range[1]]
+    if fs.shape[0] > max_points:
+        # Downsample to make plotting faster
+        fs = fs.iloc[::fs.shape[0]//max_points]
+
+    fig, bx = plt.subplots(2, 1, sharex=True, figsize=(10, 5))
+    for plt_num, payload in enumerate(payloads):
+        for column in fs.columns:
+            if column.startswith(f'{payload}_FSPC'):
+                bx[plt_num].plot(fs.index, fs[column], label=column)
+        bx[plt_num].legend(loc=1)
+    bx[0].set_title(f'BARREL {" and ".join(payloads)} fast spectra')
+    plt.savefig(save_path, dpi=200)
+    plt.close(fig)
+    return
+
+def detect(d:'find_microbursts.Detect', pair:str, save_path:pathlib.Path) -> pd.DataFrame:
+    """
+    Run Detect on its already loaded data, save the events, and append
+    them to the event catalog.
+    """
+    import event_catalog
+
+    d.detect()
+    events = d.find_events()
+    events.insert(0, 'pair', pair)
+    d.save_events(events, save_path)
+    with event_catalog.EventCatalog() as catalog:
+        # Replace the pair's previous events in the detection interval.
+        catalog.append(events, pair=pair, time_range=(d.fs.index[0], d.fs.index[-1]))
+    return events
+
+def process_pair(pair:str, pair_config:typing.Dict, detection_config:typing.Dict,
+                products:typing.List[str], append:bool=False) -> str:
+    """
+    Make the products of one pair. The merged data is made (or loaded
+    once from merged_data/) and shared by the other products. If append
+    is True, the merged data is in the per-day stores. The products 
+    that are up to date with the merged data and their parameters (see
+    provenance.py) are not remade, and the merged data is only loaded 
+    if a product needs it.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import find_microbursts
+
+    ephem, fs = None, None
+    ephem_path, fs_path = store_paths(pair) if append else merged_paths(pair)
+    if 'preprocess' in products:
+        cdf_index = file_catalog.load_index(directories.data_dir)
+        if append:
+            preprocess_append(pair, pair_config, cdf_index)
+        else:
+            sources, params = preprocess_sources(pair_config, cdf_index)
+            if all(provenance.is_fresh(path, sources, params) for path in [ephem_path, fs_path]):
+                print(f'The {pair} merged data is up to date.')
+            else:
+                ephem, fs = preprocess(pair_config, cdf_index)
+                for df, path in [(ephem, ephem_path), (fs, fs_path)]:
+                    df.to_csv(path, index_label='Time')
+                    provenance.write_metadata(path, df, sources, params)
+
+    d = find_microbursts.Detect(fs_path, ephem_path, detection_config)
+    fs_source, ephem_source = d.sources()
+    start_date = pair_config['flight_dates'][0]
+    payloads_str = '_'.join(pair_config['payloads'])
+    # The plots and events with their save path, merged sources, and parameters.
+    outputs = {
+        'trajectory':(
+            pathlib.Path(directories.plots_dir, f'{start_date}_BARREL_{payloads_str}_trajectories.pdf'),
+            [ephem_source], {'payloads':pair_config['payloads']}),
+        'fast_spectra':(
+            pathlib.Path(directories.plots_dir, f'{start_date}_BARREL_{payloads_str}_fast_spectra.png'),
+            [fs_source], {'payloads':pair_config['payloads'], 
+                          'time_range':pair_config.get('fast_spectra_range')}),
+        'detect':(
+            pathlib.Path(directories.merged_dir, f'barrel_{pair}_microbursts.csv'),
+            d.sources(), detection_config)
+        }
+    stale = []
+    for product in products:
+        if product not in outputs:
+            continue
+        if provenance.is_fresh(*outputs[product]):
+            print(f'The {pair} {product} product is up to date.')
+        else:
+            stale.append(product)
+    if len(stale) == 0:
+        return pair
+
+    if ephem is None:
+        if append:
+            ephem, fs = read_stores(pair)
+        else:
+            ephem = pd.read_csv(ephem_path, index_col=0, parse_dates=True)
+            if ('fast_spectra' in stale) or ('detect' in stale):
+                fs = pd.read_csv(fs_path, index_col=0, parse_dates=True)
+
+    if 'trajectory' in stale:
+        save_path, sources, params = outputs['trajectory']
+        plot_trajectory(ephem, pair_config['payloads'], save_path)
+        provenance.write_metadata(save_path, None, sources, params)
+    if 'fast_spectra' in stale:
+        save_path, sources, params = outputs['fast_spectra']
+        plot_fast_spectra(fs, pair_config['payloads'], params['time_range'], save_path)
+        provenance.write_metadata(save_path, None, sources, params)
+    if 'detect' in stale:
+        d.set_merged_data(fs, ephem)
+        detect(d, pair, outputs['detect'][0])
+    return pair
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Process the BARREL payload pairs.')
+    parser.add_argument('--config', default=pathlib.Path(directories.top_dir, 'flights.yaml'))
+    parser.add_argument('--pairs', nargs='+', default=None,
+        help='The pairs to process. Defaults to all pairs in the config.')
+    parser.add_argument('--products', nargs='+', default=all_products, choices=all_products)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--append', action='store_true',
+        help='Append the new flight dates to the per-day merged data stores.')
+    parser.add_argument('--rescan', action='store_true',
+        help='Rescan the whole cdf archive instead of only the changed directories.')
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    pairs = args.pairs if args.pairs is not None else list(config['pairs'])
+
+    for directory in [directories.merged_dir, directories.plots_dir]:
+        directory.mkdir(parents=True, exist_ok=True)
+    if 'preprocess' in args.products:
+        # Update the archive index once before the workers read it.
+        file_catalog.load_index(directories.data_dir, rescan=args.rescan)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(process_pair, pair, config['pairs'][pair],
+                                    config['detection'], args.products, args.append) 
+                    for pair in pairs]
+        for future in concurrent.futures.as_completed(futures):
+            print(f'Finished the {future.result()} pair.')
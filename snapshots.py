@@ -0,0 +1,102 @@
+# Renders the fast spectra around every event in an event list (e.g.
+# the batch_detect.py catalog) instead of tiling the whole flight into
+# fixed windows. All of the event windows are sliced out of the merged
+# fast spectra with one searchsorted gather, and the plots are rendered
+# in parallel, so the cost scales with the number of events instead of
+# the flight duration.
+
+import concurrent.futures
+import pathlib
+import typing
+
+import numpy as np
+import pandas as pd
+
+import directories
+
+# matplotlib is imported by the plotting workers.
+
+def extract_windows(fs:pd.DataFrame, event_times:typing.Iterable,
+                    half_width_s:float) -> typing.List[pd.DataFrame]:
+    """
+    Slice the event_times +/- half_width_s windows out of the time
+    sorted fs DataFrame. The window bounds of all events are found with
+    one searchsorted call and the rows are gathered with one take.
+    """
+    t = fs.index.values
+    centers = pd.to_datetime(pd.Series(event_times)).values.astype(t.dtype)
+    half_width = np.timedelta64(int(round(half_width_s*1E6)), 'us')
+    start_idx = np.searchsorted(t, centers - half_width, side='left')
+    end_idx = np.searchsorted(t, centers + half_width, side='right')
+
+    lengths = end_idx - start_idx
+    offsets = np.cumsum(lengths) - lengths
+    idx = np.arange(lengths.sum()) + np.repeat(start_idx - offsets, lengths)
+    gathered = fs.iloc[idx]
+    return [gathered.iloc[offset:offset+length]
+            for offset, length in zip(offsets, lengths)]
+
+def plot_snapshot(snapshot:pd.DataFrame, event:typing.Dict,
+                payloads:typing.List[str], save_path:pathlib.Path) -> pathlib.Path:
+    """
+    Plot the snapshot FSPC channels, one payload per subplot, with the
+    event time marked and the event attributes in the title.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import matplotlib.dates
+
+    fig, cx = plt.subplots(len(payloads), 1, sharex=True, figsize=(10, 5))
+    for plt_num, payload in enumerate(payloads):
+        for column in snapshot.columns:
+            if column.startswith(f'{payload}_FSPC'):
+                cx[plt_num].plot(snapshot.index, snapshot[column], label=column)
+        cx[plt_num].axvline(pd.Timestamp(event['time']), c='k', ls=':')
+        cx[plt_num].legend(loc=1, bbox_to_anchor=(1.1, 1.05))
+        cx[plt_num].grid(which='both', linestyle='--')
+
+    attributes = [f'{key}={event[key]:.1f}' for key in ['dist_km', 'L', 'MLT', 'corr']
+                    if key in event and pd.notna(event[key])]
+    cx[0].set_title(f'BARREL {" and ".join(payloads)} event at '
+                    f'{pd.Timestamp(event["time"]).strftime("%Y-%m-%d %H:%M:%S.%f")[:-4]}\n'
+                    + ', '.join(attributes))
+    cx[-1].xaxis.set_major_formatter(matplotlib.dates.DateFormatter('%H:%M:%S'))
+    cx[-1].set_xlabel('UTC')
+    plt.savefig(save_path, dpi=200)
+    plt.close(fig)
+    return save_path
+
+def render_snapshots(fs:pd.DataFrame, events:pd.DataFrame, payloads:typing.List[str],
+                    save_dir:pathlib.Path, half_width_s:float=10,
+                    n_workers:int=None) -> typing.List[pathlib.Path]:
+    """
+    Extract the windows around every events['time'] and render them in
+    parallel to save_dir. Returns the saved plot paths.
+    """
+    save_dir = pathlib.Path(save_dir)
+    save_dir.mkdir(parents=True, exist_ok=True)
+    snapshots = extract_windows(fs, events['time'], half_width_s)
+
+    save_paths = [pathlib.Path(save_dir,
+                    f'{pd.Timestamp(t).strftime("%Y%m%d_%H%M%S_%f")[:-4]}_BARREL_'
+                    f'{"_".join(payloads)}_event.png')
+                for t in events['time']]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(plot_snapshot, snapshots,
+                                events.to_dict('records'),
+                                [payloads]*len(snapshots), save_paths))
+
+if __name__ == '__main__':
+    half_width_s = 10
+    fs_path = pathlib.Path(directories.merged_dir, 'barrel_3g_3f_merged_fast_spectra.csv')
+    catalog_path = pathlib.Path(directories.merged_dir, 'barrel_microburst_catalog.csv')
+
+    fs = pd.read_csv(fs_path, index_col=0, parse_dates=True)
+    events = pd.read_csv(catalog_path, parse_dates=['time'])
+    events = events[events['pair'] == '3g_3f'].sort_values('time')
+
+    save_paths = render_snapshots(fs, events, ['3G', '3F'],
+                                pathlib.Path(directories.plots_dir, 'events'),
+                                half_width_s=half_width_s)
+    print(f'Made {len(save_paths)} event snapshots in plots/events/')